@@ -1,4 +1,5 @@
 # flake8:noqa
 
 from . import ir_attachment
+from . import controllers
 
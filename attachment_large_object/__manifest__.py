@@ -21,13 +21,16 @@
 ##############################################################################
 {
     'name': 'attachment_large_object',
-    'version': '11.0.1.0.0',
+    'version': '11.0.1.5.0',
     'category': 'Extra Tools',
     'summary': """Provides a storage option for attachments as PostgreSQL large objects.
     """,
     'author': 'Anybox',
     'website': 'anybox.fr',
     'depends': ['base'],
+    'data': [
+        'data/ir_cron.xml',
+    ],
     'test': [],
     'installable': True,
     'application': False,
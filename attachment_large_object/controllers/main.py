@@ -0,0 +1,64 @@
+import werkzeug.utils
+import werkzeug.wrappers
+
+from odoo import http
+from odoo.http import request
+
+
+class LargeObjectController(http.Controller):
+
+    @http.route([
+        '/web/content/lobject/<int:attachment_id>',
+        '/web/content/lobject/<int:attachment_id>/<string:filename>',
+    ], type='http', auth='user')
+    def content_lobject(self, attachment_id, filename=None, download=None, **kwargs):
+        """Send the attachment without loading it to memory.
+
+        Supports ``Range`` requests and ``If-None-Match`` with checksum of
+        the attachment as ETag.
+        """
+        attachment = request.env['ir.attachment'].browse(attachment_id).exists()
+        if not attachment:
+            return request.not_found()
+        values = attachment.read(['store_fname', 'datas_fname', 'mimetype', 'file_size', 'checksum'])[0]
+        store_fname = values['store_fname']
+        if not (store_fname and store_fname.isdigit()):
+            # not a large object
+            return werkzeug.utils.redirect('/web/content/%s?download=%s' % (attachment_id, download or ''))
+
+        httprequest = request.httprequest
+        size = values['file_size']
+        if not size:
+            # file_size may be not computed yet
+            size = request.env['ir.attachment'].sudo()._lobject_size(int(store_fname))
+        etag = values['checksum']
+        headers = [('Accept-Ranges', 'bytes')]
+        if etag:
+            headers.append(('ETag', '"%s"' % etag))
+            if httprequest.if_none_match.contains(etag):
+                return werkzeug.wrappers.Response(status=304, headers=headers)
+
+        start, end = 0, size - 1
+        status = 200
+        byte_range = httprequest.range
+        if_range = httprequest.headers.get('If-Range')
+        # multiple ranges and other units are not supported, so full content is sent
+        single_range = byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1
+        if single_range and (not if_range or if_range.strip('"') == etag):
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers.append(('Content-Range', 'bytes */%s' % size))
+                return werkzeug.wrappers.Response(status=416, headers=headers)
+            start, end = bounds[0], bounds[1] - 1
+            status = 206
+            headers.append(('Content-Range', 'bytes %s-%s/%s' % (start, end, size)))
+
+        filename = filename or values['datas_fname'] or 'attachment-%s' % attachment_id
+        headers += [
+            ('Content-Type', values['mimetype'] or 'application/octet-stream'),
+            ('Content-Length', end - start + 1),
+        ]
+        if download:
+            headers.append(('Content-Disposition', http.content_disposition(filename)))
+        stream = request.env['ir.attachment'].sudo()._lobject_stream(int(store_fname), start, end)
+        return werkzeug.wrappers.Response(stream, status=status, headers=headers, direct_passthrough=True)
@@ -1,5 +1,8 @@
 import logging
 import base64
+import binascii
+import io
+from collections import Counter
 from odoo import models, api
 import psycopg2
 
@@ -7,6 +10,46 @@ logger = logging.getLogger(__name__)
 
 LARGE_OBJECT_LOCATION = 'postgresql:lobject'
 
+# size of raw chunks read from large objects. Must be a multiple of 3 to
+# encode chunks to base64 independently
+CHUNK_SIZE = 3 * 1024 * 1024
+# size of base64 chunks decoded at once
+B64_CHUNK_SIZE = 4 * 1024 * 1024
+# number of attachments updated at once by _backfill_lobject_file_size
+BACKFILL_BATCH_SIZE = 1000
+# number of large objects checked at once by _gc_lobjects
+GC_BATCH_SIZE = 1000
+# INV_READ flag of lo_open
+INV_READ = 0x40000
+
+
+def b64encode_iter(chunks):
+    """Encode stream of bytes to base64 chunk by chunk."""
+    rest = b''
+    for chunk in chunks:
+        chunk = rest + chunk
+        size = len(chunk) - len(chunk) % 3
+        rest = chunk[size:]
+        if size:
+            yield base64.b64encode(chunk[:size])
+    if rest:
+        yield base64.b64encode(rest)
+
+
+def b64decode_iter(value, chunk_size=B64_CHUNK_SIZE):
+    """Decode base64 encoded value chunk by chunk. Line breaks are ignored."""
+    if isinstance(value, str):
+        value = value.encode('ascii')
+    rest = b''
+    for start in range(0, len(value), chunk_size):
+        chunk = rest + b''.join(value[start:start + chunk_size].split())
+        size = len(chunk) - len(chunk) % 4
+        rest = chunk[size:]
+        if size:
+            yield binascii.a2b_base64(chunk[:size])
+    if rest:
+        yield base64.b64decode(rest)
+
 
 class IrAttachment(models.Model):
     """Provide storage as PostgreSQL large objects of attachements with filestore location ``postgresql:lobject``.
@@ -19,6 +62,18 @@ class IrAttachment(models.Model):
     _name = 'ir.attachment'
     _inherit = 'ir.attachment'
 
+    @api.model_cr
+    def init(self):
+        super(IrAttachment, self).init()
+        # Large objects are shared by attachments with the same content
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS ir_attachment_lobject_ref (
+                checksum varchar PRIMARY KEY,
+                oid oid NOT NULL UNIQUE,
+                refcount integer NOT NULL
+            )
+        """)
+
     @api.model
     def lobject(self, cr, *args):
         return cr._cnx.lobject(*args)
@@ -34,40 +89,218 @@ class IrAttachment(models.Model):
         if location != LARGE_OBJECT_LOCATION:
             return super(IrAttachment, self)._file_write(value, checksum)
 
-        lobj = self.lobject(self.env.cr, 0, 'wb')  # oid=0 means creation
-        lobj.write(base64.b64decode(value))
+        return self._lobject_write(b64decode_iter(value), checksum)
+
+    @api.model
+    def _lobject_write(self, chunks, checksum=None):
+        """Write raw chunks in a newly created large object.
+
+        If ``checksum`` is given and a large object with the same checksum
+        exists, it's reused and ``chunks`` are not consumed.
+
+        :returns str: object id
+        """
+        cr = self.env.cr
+        if checksum:
+            cr.execute("""
+                UPDATE ir_attachment_lobject_ref
+                SET refcount = refcount + 1
+                WHERE checksum = %s
+                RETURNING oid
+            """, (checksum,))
+            row = cr.fetchone()
+            if row:
+                return str(row[0])
+
+        lobj = self.lobject(cr, 0, 'wb')  # oid=0 means creation
+        for chunk in chunks:
+            lobj.write(chunk)
         oid = lobj.oid
-        return str(oid)
+        lobj.close()
+        if not checksum:
+            return str(oid)
+
+        # the same content may be written by concurrent transaction
+        cr.execute("""
+            INSERT INTO ir_attachment_lobject_ref AS ref (checksum, oid, refcount)
+            VALUES (%s, %s, 1)
+            ON CONFLICT (checksum) DO UPDATE SET refcount = ref.refcount + 1
+            RETURNING oid
+        """, (checksum, oid))
+        shared_oid = cr.fetchone()[0]
+        if shared_oid != oid:
+            self.lobject(cr, oid, 'rb').unlink()
+        return str(shared_oid)
+
+    @api.multi
+    def unlink(self):
+        # files of deleted attachments are deleted once per file, so
+        # references of large objects used several times are released here
+        fnames = Counter(a.store_fname for a in self if a.store_fname and a.store_fname.isdigit())
+        for fname, count in fnames.items():
+            if count > 1:
+                self.env.cr.execute("""
+                    UPDATE ir_attachment_lobject_ref
+                    SET refcount = refcount - %s
+                    WHERE oid = %s
+                """, (count - 1, int(fname)))
+        return super(IrAttachment, self).unlink()
 
     def _file_delete(self, fname):
-        filestore = False
-        try:
-            oid = int(fname)
-        except:
-            filestore = True
+        """Release reference to the large object.
 
-        if not filestore:
-            try:
-                return self.lobject(self.env.cr, oid, 'rb').unlink()
-            except (psycopg2.OperationalError, ValueError):
-                filestore = True
+        The object itself is deleted by ``_gc_lobjects`` when no attachment
+        uses it, so deleting is cheap and is rolled back with the transaction.
+        """
+        if not (fname and fname.isdigit()):
+            return super(IrAttachment, self)._file_delete(fname)
 
-        return super(IrAttachment, self)._file_delete(fname)
+        cr = self.env.cr
+        cr.execute("""
+            UPDATE ir_attachment_lobject_ref
+            SET refcount = refcount - 1
+            WHERE oid = %s
+            RETURNING refcount
+        """, (int(fname),))
+        row = cr.fetchone()
+        if row and row[0] <= 0:
+            cr.execute("DELETE FROM ir_attachment_lobject_ref WHERE oid = %s", (int(fname),))
+
+    @api.model
+    def _gc_lobjects(self, batch_size=GC_BATCH_SIZE, max_batches=None):
+        """Unlink large objects that are not used by attachments.
+
+        Only objects owned by the current database user are checked. Every
+        batch is committed.
+
+        :param max_batches: stop after that number of batches. None means no limit
+        :returns int: number of unlinked objects
+        """
+        cr = self.env.cr
+        last_oid = 0
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            cr.execute("""
+                SELECT m.oid
+                FROM pg_largeobject_metadata m
+                WHERE m.lomowner = (SELECT oid FROM pg_roles WHERE rolname = current_user)
+                  AND m.oid > %s
+                  AND NOT EXISTS (SELECT 1 FROM ir_attachment a WHERE a.store_fname = m.oid::text)
+                  AND NOT EXISTS (SELECT 1 FROM ir_attachment_lobject_ref r WHERE r.oid = m.oid)
+                ORDER BY m.oid
+                LIMIT %s
+            """, (last_oid, batch_size))
+            oids = [row[0] for row in cr.fetchall()]
+            if not oids:
+                break
+            cr.execute("SELECT lo_unlink(oid) FROM unnest(%s::oid[]) AS oid", (oids,))
+            cr.commit()
+            last_oid = oids[-1]
+            total += len(oids)
+            batches += 1
+            logger.info('%s unused large objects are deleted', total)
+        return total
 
     def _lobject_read(self, fname, bin_size):
         """Read the large object, base64 encoded.
 
         :param fname: file storage name, must be the oid as a string.
         """
-        lobj = self.lobject(self.env.cr, int(fname), 'rb')
         if bin_size:
+            return self._lobject_size(int(fname))
+        # BytesIO returns its buffer without copying, unlike joining the list
+        # of chunks, so only encoded content is kept in memory
+        buf = io.BytesIO()
+        for chunk in b64encode_iter(self._lobject_iter(self.env.cr, int(fname))):
+            buf.write(chunk)
+        return buf.getvalue()
+
+    @api.model
+    def _lobject_size(self, oid):
+        """Return size of the large object without reading it."""
+        lobj = self.lobject(self.env.cr, oid, 'rb')
+        try:
             return lobj.seek(0, 2)
-        return base64.b64encode(lobj.read())  # GR TODO it must be possible to read-encode in chunks
+        finally:
+            lobj.close()
+
+    def _lobject_iter(self, cr, oid, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """Read the large object in chunks of raw bytes.
+
+        :param start: offset of the first byte
+        :param end: offset of the last byte, inclusive. None means end of the object
+        """
+        lobj = self.lobject(cr, oid, 'rb')
+        try:
+            lobj.seek(start)
+            left = None if end is None else end - start + 1
+            while left is None or left > 0:
+                chunk = lobj.read(chunk_size if left is None else min(chunk_size, left))
+                if not chunk:
+                    break
+                if left is not None:
+                    left -= len(chunk)
+                yield chunk
+        finally:
+            lobj.close()
+
+    def _lobject_stream(self, oid, start=0, end=None):
+        """Read the large object in a separate cursor.
+
+        It's used for HTTP responses, which are sent after the request cursor
+        is closed.
+        """
+        with self.pool.cursor() as cr:
+            for chunk in self._lobject_iter(cr, oid, start, end):
+                yield chunk
+
+    @api.model
+    def _backfill_lobject_file_size(self, batch_size=BACKFILL_BATCH_SIZE):
+        """Compute ``file_size`` of large objects where it's not set.
+
+        Sizes are computed by PostgreSQL without reading the content.
+        Every batch is committed.
+        """
+        last_id = 0
+        total = 0
+        while True:
+            self.env.cr.execute("""
+                WITH batch AS (
+                    SELECT a.id, a.store_fname::oid AS oid
+                    FROM ir_attachment a
+                    JOIN pg_largeobject_metadata m ON m.oid = (
+                        CASE WHEN a.store_fname ~ '^[0-9]+$' THEN a.store_fname::oid END)
+                    WHERE a.id > %s
+                      AND (a.file_size IS NULL OR a.file_size = 0)
+                    ORDER BY a.id
+                    LIMIT %s
+                )
+                UPDATE ir_attachment a
+                SET file_size = lo_lseek64(lo_open(batch.oid, %s), 0, 2)
+                FROM batch
+                WHERE a.id = batch.id
+                RETURNING a.id
+            """, (last_id, batch_size, INV_READ))
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            # close descriptors opened by lo_open
+            self.env.cr.commit()
+            if not ids:
+                break
+            last_id = max(ids)
+            total += len(ids)
+            logger.info('File size is computed for %s large objects', total)
+        self.invalidate_cache(['file_size'])
+        return total
 
     @api.depends('store_fname', 'db_datas')
     def _compute_datas(self):
         bin_size = self._context.get('bin_size')
         for attach in self:
+            if bin_size and attach.store_fname and attach.store_fname.isdigit():
+                # file_size is set on writing, so the large object is not opened
+                attach.datas = attach.file_size
+                continue
             try:
                 attach.datas = self._lobject_read(attach.store_fname, bin_size)
             except (psycopg2.OperationalError, ValueError):
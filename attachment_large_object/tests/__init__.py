@@ -1 +1,2 @@
 from . import test_attachment
+from . import test_controller
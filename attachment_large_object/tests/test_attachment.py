@@ -1,7 +1,11 @@
 import base64
 
+from unittest.mock import patch
+
 from openerp.tests.common import TransactionCase
 
+from ..ir_attachment import b64decode_iter, b64encode_iter
+
 
 class TestAttachment(TransactionCase):
 
@@ -21,6 +25,7 @@ class TestAttachment(TransactionCase):
             att_r = att_r[0]
         self.assertEqual(att_r['datas'], bin_data)
         self.assertEqual(att_r['file_size'], 6)
+        self.assertEqual(att.with_context(bin_size=True).datas, 6)
         try:
             oid = int(att_r['store_fname'])
         except TypeError:
@@ -39,3 +44,74 @@ class TestAttachment(TransactionCase):
         self.assertNotEqual(att_r['store_fname'], str(oid))
 
         att.unlink()
+
+    def test_chunks(self):
+        data = bytes(bytearray(range(256))) * 10
+        chunks = [data[i:i + 100] for i in range(0, len(data), 100)]
+        encoded = b''.join(b64encode_iter(chunks))
+        self.assertEqual(encoded, base64.b64encode(data))
+        # line breaks as in base64.encodebytes
+        encoded = base64.encodebytes(data)
+        self.assertEqual(b''.join(b64decode_iter(encoded, chunk_size=10)), data)
+
+        self.param.set_param('ir_attachment.location', 'postgresql:lobject')
+        att = self.attachment.create(dict(name="some name", datas=encoded))
+        self.assertEqual(att.datas, base64.b64encode(data))
+
+    def test_dedup(self):
+        self.param.set_param('ir_attachment.location', 'postgresql:lobject')
+        bin_data = base64.b64encode(b"same content")
+        att1 = self.attachment.create(dict(name="first", datas=bin_data))
+        att2 = self.attachment.create(dict(name="second", datas=bin_data))
+        self.assertEqual(att1.store_fname, att2.store_fname)
+
+        att1.unlink()
+        self.assertEqual(att2.datas, bin_data)
+
+        att3 = self.attachment.create(dict(name="third", datas=bin_data))
+        oid = int(att2.store_fname)
+        (att2 | att3).unlink()
+        self.env.cr.execute("SELECT 1 FROM ir_attachment_lobject_ref WHERE oid = %s", (oid,))
+        self.assertFalse(self.env.cr.fetchall())
+
+    def _lobject_exists(self, oid):
+        self.env.cr.execute("SELECT 1 FROM pg_largeobject_metadata WHERE oid = %s", (oid,))
+        return bool(self.env.cr.fetchall())
+
+    def _create_lobject(self):
+        lobj = self.attachment.lobject(self.env.cr, 0, 'wb')
+        lobj.write(b'data')
+        return lobj.oid
+
+    def test_gc(self):
+        self.param.set_param('ir_attachment.location', 'postgresql:lobject')
+        cr = self.env.cr
+        orphan = self._create_lobject()
+
+        # object of attachment created before reference counting
+        legacy = self._create_lobject()
+        legacy_att = self.attachment.create(dict(name="legacy"))
+        cr.execute("UPDATE ir_attachment SET store_fname = %s WHERE id = %s", (str(legacy), legacy_att.id))
+
+        # object with reference only
+        referenced = self._create_lobject()
+        cr.execute("""
+            INSERT INTO ir_attachment_lobject_ref (checksum, oid, refcount)
+            VALUES ('test-gc', %s, 1)
+        """, (referenced,))
+
+        # copy shares store_fname without taking a reference
+        bin_data = base64.b64encode(b"copied content")
+        att = self.attachment.create(dict(name="original", datas=bin_data))
+        copy = att.copy()
+        shared = int(att.store_fname)
+        att.unlink()
+
+        with patch.object(cr, 'commit'):
+            self.attachment._gc_lobjects(batch_size=2)
+
+        self.assertFalse(self._lobject_exists(orphan))
+        self.assertTrue(self._lobject_exists(legacy))
+        self.assertTrue(self._lobject_exists(referenced))
+        self.assertTrue(self._lobject_exists(shared))
+        self.assertEqual(copy.datas, bin_data)
@@ -0,0 +1,71 @@
+import base64
+
+from openerp.tests.common import HOST, PORT, HttpCase, at_install, post_install
+
+CONTENT = b'0123456789'
+
+
+@at_install(False)
+@post_install(True)
+class TestController(HttpCase):
+
+    def setUp(self):
+        super(TestController, self).setUp()
+        self.env['ir.config_parameter'].set_param('ir_attachment.location', 'postgresql:lobject')
+        self.attachment = self.env['ir.attachment'].create({
+            'name': 'digits.txt',
+            'datas': base64.b64encode(CONTENT),
+        })
+        self.url = '/web/content/lobject/%s' % self.attachment.id
+        self.etag = '"%s"' % self.attachment.checksum
+        self.authenticate('admin', 'admin')
+
+    def _get(self, **headers):
+        return self.opener.get('http://%s:%s%s' % (HOST, PORT, self.url), headers=headers, timeout=10)
+
+    def test_full(self):
+        res = self._get()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, CONTENT)
+        self.assertEqual(res.headers['ETag'], self.etag)
+        self.assertEqual(res.headers['Accept-Ranges'], 'bytes')
+
+    def test_range(self):
+        res = self._get(Range='bytes=2-5')
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.content, b'2345')
+        self.assertEqual(res.headers['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(res.headers['Content-Length'], '4')
+
+    def test_range_not_satisfiable(self):
+        res = self._get(Range='bytes=20-30')
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res.headers['Content-Range'], 'bytes */10')
+
+    def test_multiple_ranges(self):
+        # not supported ranges are ignored
+        res = self._get(Range='bytes=0-1,4-5')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, CONTENT)
+        self.assertNotIn('Content-Range', res.headers)
+
+    def test_if_none_match(self):
+        res = self._get(**{'If-None-Match': self.etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertFalse(res.content)
+
+    def test_if_range(self):
+        res = self._get(Range='bytes=2-5', **{'If-Range': self.etag})
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.content, b'2345')
+        # content is changed since client got it, so it's sent in full
+        res = self._get(Range='bytes=2-5', **{'If-Range': '"outdated"'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, CONTENT)
+
+    def test_empty_file_size(self):
+        self.env.cr.execute("UPDATE ir_attachment SET file_size = NULL WHERE id = %s", (self.attachment.id,))
+        res = self._get()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, CONTENT)
+        self.assertEqual(res.headers['Content-Length'], '10')
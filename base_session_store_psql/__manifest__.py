@@ -3,7 +3,7 @@
     "summary": """Fixes "Session Expired" issue in destributed deployment""",
     "category": "Extra Tools",
     "images": [],
-    "version": "1.0.0",
+    "version": "1.9.0",
 
     "author": "IT-Projects LLC, Ivan Yelizariev",
     "website": "https://it-projects.info",
@@ -0,0 +1,121 @@
+"""Compare payload size and encoding time of session serializers.
+
+Usage::
+
+    python base_session_store_psql/benchmarks/bench_serializers.py [--number 2000]
+
+Sessions are built to look like ``odoo.http.OpenERPSession`` contents:
+a fresh login, a typical backend session and a session with cached data.
+"""
+import argparse
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from base_session_store_psql import serializers  # noqa: E402
+
+
+def login_session():
+    return {
+        'db': 'production',
+        'login': None,
+        'uid': None,
+        'session_token': None,
+        'context': {},
+        'debug': '',
+    }
+
+
+def backend_session():
+    session = login_session()
+    session.update({
+        'login': 'demo@example.com',
+        'uid': 7,
+        'session_token': uuid.uuid4().hex * 2,
+        'context': {
+            'lang': 'en_US',
+            'tz': 'Europe/Brussels',
+            'uid': 7,
+        },
+        'geoip': {
+            'city': 'Brussels',
+            'country_code': 'BE',
+            'country_name': 'Belgium',
+            'region': 'BRU',
+            'time_zone': 'Europe/Brussels',
+        },
+    })
+    return session
+
+
+def cached_data_session():
+    session = backend_session()
+    session['context'].update({
+        'search_default_my_tasks': 1,
+        'allowed_company_ids': list(range(1, 30)),
+        'active_ids': list(range(1000, 1500)),
+    })
+    session['website_sale_last_products'] = [
+        {'id': i, 'name': 'Product %s' % i, 'price': i * 1.5, 'currency': 'EUR'}
+        for i in range(200)
+    ]
+    return session
+
+
+SESSIONS = [
+    ('login', login_session),
+    ('backend', backend_session),
+    ('cached data', cached_data_session),
+]
+
+CONFIGURATIONS = [
+    ('pickle', None),
+    ('pickle', 'zlib'),
+    ('pickle', 'lz4'),
+    ('json', None),
+    ('json', 'zlib'),
+    ('msgpack', None),
+    ('msgpack', 'zlib'),
+]
+
+
+def is_available(serializer_name, compression):
+    if serializer_name == 'msgpack' and not serializers.msgpack:
+        return False
+    if compression == 'lz4' and not serializers.lz4:
+        return False
+    return True
+
+
+def run(number):
+    print('%-12s %-8s %-6s %8s %12s %12s' % ('session', 'format', 'comp', 'bytes', 'dumps, us', 'loads, us'))
+    for session_name, make_session in SESSIONS:
+        data = make_session()
+        for serializer_name, compression in CONFIGURATIONS:
+            if not is_available(serializer_name, compression):
+                continue
+            serializer = serializers.Serializer(serializer_name, compression, threshold=1024)
+            payload = serializer.dumps(data)
+            dumps_time = timeit.timeit(lambda: serializer.dumps(data), number=number)
+            loads_time = timeit.timeit(lambda: serializer.loads(payload), number=number)
+            print('%-12s %-8s %-6s %8d %12.2f %12.2f' % (
+                session_name,
+                serializer_name,
+                compression or '-',
+                len(payload),
+                dumps_time / number * 10 ** 6,
+                loads_time / number * 10 ** 6,
+            ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=2000, help='Repetitions per measurement')
+    args = parser.parse_args()
+    skipped = [c for c in CONFIGURATIONS if not is_available(*c)]
+    if skipped:
+        print('Skipped (package is not installed): %s\n' % ', '.join('%s+%s' % c for c in skipped))
+    run(args.number)
@@ -0,0 +1,172 @@
+"""Load test of session stores.
+
+Runs a mix of get/save/delete/list operations from several processes against
+``PostgresSessionStore`` and werkzeug's ``FilesystemSessionStore`` and
+reports latency percentiles and throughput.
+
+Usage::
+
+    python base_session_store_psql/benchmarks/bench_stores.py -c /path/to/odoo.conf \\
+        --backend all --workers 8 --operations 2000
+
+PostgreSQL connection parameters and ``session_store_*`` options are taken
+from odoo config file. Use ``--max-p99`` to fail (exit code 1) when p99
+latency of any operation is higher than given number of milliseconds, e.g.
+in CI.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_serializers import backend_session  # noqa: E402
+
+BACKENDS = ['psql', 'filesystem']
+
+# relative frequency of operations
+OPERATIONS = [
+    ('get', 80),
+    ('save', 15),
+    ('delete', 4),
+    ('list', 1),
+]
+
+
+def make_store(backend, path):
+    import odoo
+    from werkzeug.contrib.sessions import FilesystemSessionStore
+    session_class = odoo.http.OpenERPSession
+    if backend == 'psql':
+        from base_session_store_psql.sessionstore import PostgresSessionStore
+        return PostgresSessionStore(session_class=session_class)
+    return FilesystemSessionStore(path, session_class=session_class)
+
+
+def load_config(config_file, session_store_db):
+    import odoo
+    args = ['-c', config_file] if config_file else []
+    odoo.tools.config.parse_config(args)
+    if session_store_db:
+        odoo.tools.config['session_store_db'] = session_store_db
+
+
+def prepare(backend, path, sessions):
+    """Save initial sessions and return their sids."""
+    store = make_store(backend, path)
+    sids = []
+    for i in range(sessions):
+        session = store.new()
+        session.update(backend_session())
+        store.save(session)
+        sids.append(session.sid)
+    return sids
+
+
+def work(backend, path, sids, operations, seed, config_file, session_store_db):
+    """Run operations in a worker process.
+
+    :returns dict: operation -> list of latencies in seconds
+    """
+    load_config(config_file, session_store_db)
+    store = make_store(backend, path)
+    rnd = random.Random(seed)
+    names = [name for name, weight in OPERATIONS for i in range(weight)]
+    latencies = {name: [] for name, weight in OPERATIONS}
+    for i in range(operations):
+        name = rnd.choice(names)
+        sid = rnd.choice(sids)
+        start = time.time()
+        if name == 'get':
+            store.get(sid)
+        elif name == 'save':
+            session = store.get(sid)
+            session['context'] = dict(session.get('context') or {}, counter=i)
+            store.save(session)
+        elif name == 'delete':
+            store.delete(store.session_class({}, sid, False))
+        else:
+            store.list()
+        latencies[name].append(time.time() - start)
+        if name == 'delete':
+            # keep number of sessions constant
+            session = store.session_class(backend_session(), sid, True)
+            store.save(session)
+    writer = getattr(store, '_get_active_writer', lambda: None)()
+    if writer:
+        writer.stop()
+    return latencies
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_backend(backend, args):
+    path = tempfile.mkdtemp(prefix='bench_sessions_')
+    try:
+        sids = prepare(backend, path, args.sessions)
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                executor.submit(work, backend, path, sids, args.operations, seed, args.config, args.session_store_db)
+                for seed in range(args.workers)
+            ]
+            results = [f.result() for f in futures]
+        duration = time.time() - start
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    latencies = {name: [] for name, weight in OPERATIONS}
+    for result in results:
+        for name, values in result.items():
+            latencies[name].extend(values)
+    total = sum(len(values) for values in latencies.values())
+    print('\n%s: %d operations in %.2f s, %.1f ops/s' % (backend, total, duration, total / duration))
+    print('%-8s %8s %10s %10s' % ('op', 'count', 'p50, ms', 'p99, ms'))
+    worst_p99 = 0
+    for name, weight in OPERATIONS:
+        values = latencies[name]
+        if not values:
+            continue
+        p50 = percentile(values, 50) * 1000
+        p99 = percentile(values, 99) * 1000
+        worst_p99 = max(worst_p99, p99)
+        print('%-8s %8d %10.2f %10.2f' % (name, len(values), p50, p99))
+    return worst_p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--config', help='Odoo config file')
+    parser.add_argument('--session-store-db', help='Database for PostgresSessionStore. Overrides config')
+    parser.add_argument('--backend', choices=BACKENDS + ['all'], default='all')
+    parser.add_argument('--workers', type=int, default=4, help='Number of concurrent processes')
+    parser.add_argument('--sessions', type=int, default=1000, help='Number of sessions in the store')
+    parser.add_argument('--operations', type=int, default=1000, help='Operations per worker')
+    parser.add_argument('--max-p99', type=float, help='Fail if p99 latency is higher, in milliseconds')
+    args = parser.parse_args()
+
+    load_config(args.config, args.session_store_db)
+    backends = BACKENDS if args.backend == 'all' else [args.backend]
+    failed = []
+    for backend in backends:
+        worst_p99 = run_backend(backend, args)
+        if args.max_p99 and worst_p99 > args.max_p99:
+            failed.append(backend)
+    if failed:
+        print('\np99 latency is higher than %s ms: %s' % (args.max_p99, ', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
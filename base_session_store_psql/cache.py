@@ -0,0 +1,62 @@
+import threading
+import time
+
+from collections import OrderedDict, namedtuple
+
+CacheEntry = namedtuple('CacheEntry', ['version', 'payload', 'validated_at'])
+
+
+class LRUCache(object):
+    """Thread-safe cache of session payloads.
+
+    Least recently used entries are evicted when number of entries or total
+    size of payloads exceeds the limits. Entries older than ``ttl`` seconds
+    are not returned.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.validated_at > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, version, payload):
+        if len(payload) > self.max_bytes:
+            self.pop(key)
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CacheEntry(version, payload, time.time())
+            self._bytes += len(payload)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.payload)
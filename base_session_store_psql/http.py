@@ -1,4 +1,5 @@
 import logging
+import random
 
 import odoo
 from odoo.tools.func import lazy_property
@@ -17,5 +18,16 @@ class RootTkobr(odoo.http.Root):
         return PostgresSessionStore(session_class=odoo.http.OpenERPSession)
 
 
+def session_gc(session_store):
+    if not isinstance(session_store, PostgresSessionStore):
+        return session_gc_origin(session_store)
+    if random.random() < session_store.gc_probability:
+        # delete only one batch to keep request fast
+        session_store.gc(max_batches=1)
+
+
+session_gc_origin = odoo.http.session_gc
+odoo.http.session_gc = session_gc
+
 root = RootTkobr()
 odoo.http.root.session_store = root.session_store
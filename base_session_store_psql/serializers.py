@@ -0,0 +1,145 @@
+"""Encoding of session payloads.
+
+Every payload starts with a format byte: low bits define serializer, high
+bits define compression. Payloads saved by previous versions of the module
+are plain pickles. They start with PROTO opcode (``0x80``), which never
+collides with format bytes, so they remain readable.
+"""
+import json
+import logging
+import pickle
+import zlib
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+PICKLE = 0x01
+JSON = 0x02
+MSGPACK = 0x03
+SERIALIZER_MASK = 0x0f
+
+ZLIB = 0x10
+LZ4 = 0x20
+COMPRESSION_MASK = 0x70
+
+PICKLE_PROTO = 0x80
+
+SERIALIZERS = {
+    'pickle': PICKLE,
+    'json': JSON,
+    'msgpack': MSGPACK,
+}
+
+COMPRESSIONS = {
+    'zlib': ZLIB,
+    'lz4': LZ4,
+}
+
+
+def _pickle_dumps(data):
+    return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+def _json_dumps(data):
+    return json.dumps(data, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def _json_loads(payload):
+    return json.loads(payload.decode('utf-8'))
+
+
+def _msgpack_dumps(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_loads(payload):
+    return msgpack.unpackb(payload, raw=False)
+
+
+DUMPS = {
+    PICKLE: _pickle_dumps,
+    JSON: _json_dumps,
+    MSGPACK: _msgpack_dumps,
+}
+
+LOADS = {
+    PICKLE: pickle.loads,
+    JSON: _json_loads,
+    MSGPACK: _msgpack_loads,
+}
+
+
+class Serializer(object):
+    """Converts session data to bytes and back.
+
+    JSON and msgpack don't support all python types. Sessions that cannot be
+    encoded by them are pickled. Note that both of them convert tuples to lists
+    and JSON converts dictionary keys to strings.
+
+    :param serializer: ``pickle``, ``json`` or ``msgpack``
+    :param compression: ``zlib``, ``lz4`` or None
+    :param threshold: payloads smaller than this number of bytes are not compressed
+    """
+
+    def __init__(self, serializer='pickle', compression=None, threshold=1024):
+        if serializer not in SERIALIZERS:
+            raise ValueError('Unknown session serializer: %s' % serializer)
+        if compression and compression not in COMPRESSIONS:
+            raise ValueError('Unknown session compression: %s' % compression)
+        if serializer == 'msgpack' and not msgpack:
+            _logger.warning('msgpack package is not found. Sessions are pickled')
+            serializer = 'pickle'
+        if compression == 'lz4' and not lz4:
+            _logger.warning('lz4 package is not found. Sessions are compressed by zlib')
+            compression = 'zlib'
+        self.serializer = SERIALIZERS[serializer]
+        self.compression = COMPRESSIONS.get(compression, 0)
+        self.threshold = threshold
+
+    def dumps(self, data):
+        serializer = self.serializer
+        try:
+            payload = DUMPS[serializer](data)
+        except (TypeError, ValueError):
+            serializer = PICKLE
+            payload = DUMPS[serializer](data)
+
+        compression = 0
+        if self.compression and len(payload) >= self.threshold:
+            compression = self.compression
+            if compression == ZLIB:
+                payload = zlib.compress(payload)
+            else:
+                payload = lz4.frame.compress(payload)
+
+        return bytes([serializer | compression]) + payload
+
+    def loads(self, payload):
+        payload = bytes(payload)
+        tag = payload[0]
+        if tag == PICKLE_PROTO:
+            return pickle.loads(payload)
+
+        payload = payload[1:]
+        compression = tag & COMPRESSION_MASK
+        if compression == ZLIB:
+            payload = zlib.decompress(payload)
+        elif compression == LZ4:
+            payload = lz4.frame.decompress(payload)
+        elif compression:
+            raise ValueError('Unknown session compression: %s' % compression)
+
+        loads = LOADS.get(tag & SERIALIZER_MASK)
+        if not loads:
+            raise ValueError('Unknown session serializer: %s' % (tag & SERIALIZER_MASK))
+        return loads(payload)
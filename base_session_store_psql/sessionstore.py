@@ -17,48 +17,284 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
-import pickle
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
 
+from collections import OrderedDict
 from contextlib import closing
-from odoo.sql_db import db_connect
-from odoo.tools import config
+from odoo.sql_db import db_connect, connection_info_for, ConnectionPool, Connection
+from odoo.tools import config, str2bool
 
 import psycopg2
 
 from werkzeug.contrib.sessions import SessionStore
 
+from .cache import LRUCache
+from .serializers import Serializer
+from .writer import SessionWriter
+
+_logger = logging.getLogger(__name__)
+
+# arbitrary key for pg_advisory_xact_lock
+SETUP_LOCK_KEY = 0x5e55104
+
+# session attribute with sid, digest of the stored payload and uid
+STATE_ATTR = '_sessionstore_state'
+
+# columns added after first version of the table
+COLUMNS = [
+    ('created_at', "timestamp NOT NULL DEFAULT (now() at time zone 'UTC')"),
+    ('last_access', "timestamp NOT NULL DEFAULT (now() at time zone 'UTC')"),
+    ('version', "integer NOT NULL DEFAULT 1"),
+    ('uid', "integer"),
+    ('db', "varchar"),
+]
+
+# number of sessions processed per query when filling new columns
+MIGRATION_BATCH_SIZE = 1000
+
 
 class PostgresSessionStore(SessionStore):
 
     def __init__(self, session_class=None):
         super(PostgresSessionStore, self).__init__(session_class=session_class)
-        # set value to avoid errors in session_gc function
-        self.path = config.session_dir
+        self.db_name = config.get('session_store_db', 'session_store')
+        self.maxconn = int(config.get('session_store_maxconn', 8))
+        self.unlogged = str2bool(str(config.get('session_store_unlogged', False)))
+        # number of hash partitions; table is not partitioned if 0
+        self.partitions = int(config.get('session_store_partitions', 0))
+        # sessions not used during this period are removed, in seconds
+        self.max_age = int(config.get('session_store_max_age', 7 * 24 * 60 * 60))
+        # last access time is updated not often than this period, in seconds
+        self.touch_interval = int(config.get('session_store_touch_interval', 5 * 60))
+        self.gc_batch_size = int(config.get('session_store_gc_batch_size', 10000))
+        self.gc_probability = float(config.get('session_store_gc_probability', 0.001))
+        self.serializer = Serializer(
+            serializer=config.get('session_store_serializer', 'pickle'),
+            compression=config.get('session_store_compression') or None,
+            threshold=int(config.get('session_store_compression_threshold', 1024)),
+        )
+        self.cache = None
+        cache_size = int(config.get('session_store_cache_size', 0))
+        if cache_size:
+            self.cache = LRUCache(
+                max_entries=cache_size,
+                max_bytes=int(config.get('session_store_cache_bytes', 64 * 1024 * 1024)),
+                ttl=int(config.get('session_store_cache_ttl', 5 * 60)),
+            )
+        # cached sessions are used without checking database during this period, in seconds
+        self.cache_staleness = float(config.get('session_store_cache_staleness', 0))
+        self.write_behind = str2bool(str(config.get('session_store_write_behind', False)))
+        self.write_behind_queue = int(config.get('session_store_write_behind_queue', 1000))
+        self.write_behind_interval = float(config.get('session_store_write_behind_interval', 0.1))
+        self._writer = None
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._connection = None
+        self._setup_db()
+
+    def _get_connection(self):
+        """Return connection to session store database backed by dedicated pool.
+
+        Pool is recreated after fork, because connections of parent process
+        must not be used by workers.
+        """
+        pid = os.getpid()
+        if self._pool_pid != pid:
+            with self._lock:
+                if self._pool_pid != pid:
+                    db, info = connection_info_for(self.db_name)
+                    self._pool = ConnectionPool(self.maxconn)
+                    self._connection = Connection(self._pool, db, info)
+                    self._pool_pid = pid
+        return self._connection
+
+    def get_cursor(self):
+        # Odoo cursors are REPEATABLE READ by default, where concurrent
+        # upserts of the same session fail with serialization errors
+        return self._get_connection().cursor(serialized=False)
 
-    def get_cursor(self, create_session_store_db=True):
-        db_name = config.get('session_store_db', 'session_store')
+    def _get_writer(self):
+        """Return background writer of current process, start it if needed."""
+        pid = os.getpid()
+        if self._writer_pid != pid:
+            with self._lock:
+                if self._writer_pid != pid:
+                    self._writer = SessionWriter(
+                        self,
+                        max_queue=self.write_behind_queue,
+                        interval=self.write_behind_interval,
+                    )
+                    self._writer.start()
+                    # flush pending sessions on worker shutdown
+                    atexit.register(self._writer.stop)
+                    self._writer_pid = pid
+        return self._writer
+
+    def _get_active_writer(self):
+        """Return background writer if it's started in current process."""
+        if self._writer_pid == os.getpid():
+            return self._writer
+        return None
+
+    def _discard_pending(self, sids):
+        writer = self._get_active_writer()
+        if writer:
+            writer.discard(sids)
+
+    def _setup_db(self, create_session_store_db=True):
+        """Create database and table if needed. It's done once per store."""
         try:
-            con = db_connect(db_name)
-            cr = con.cursor()
-        except:
+            cr = self.get_cursor()
+        except psycopg2.OperationalError:
             if not create_session_store_db:
                 raise
-            db_connect('postgres')
             with closing(db_connect('postgres').cursor()) as cr:
                 cr.autocommit(True)     # avoid transaction block
-                cr.execute("""CREATE DATABASE "%s" ENCODING 'unicode' TEMPLATE "%s" """ % (db_name, config['db_template']))
-            return self.get_cursor(create_session_store_db=False)
+                cr.execute("""CREATE DATABASE "%s" ENCODING 'unicode' TEMPLATE "%s" """ % (self.db_name, config['db_template']))
+            return self._setup_db(create_session_store_db=False)
+
+        with cr:
+            # prevent parallel migrations from several servers started at once
+            cr.execute("SELECT pg_advisory_xact_lock(%s)", (SETUP_LOCK_KEY,))
+            cr.execute("SELECT to_regclass('sessionstore')")
+            if cr.fetchone()[0]:
+                self._migrate_primary_key(cr)
+                self._migrate_columns(cr)
+                self._migrate_layout(cr)
+            else:
+                self._create_table(cr)
+            cr.execute(
+                """
+                CREATE INDEX IF NOT EXISTS sessionstore_last_access_index
+                ON sessionstore (last_access)
+                """)
+            cr.execute(
+                """
+                CREATE INDEX IF NOT EXISTS sessionstore_db_uid_index
+                ON sessionstore (db, uid)
+                """)
+        _logger.debug('Sessions table is ready in database %s', self.db_name)
+        # don't keep bootstrap connection, otherwise it's inherited by forked workers
+        self._pool.close_all()
 
+    def _migrate_primary_key(self, cr):
+        """Add primary key to sessions table created by previous versions."""
         cr.execute(
             """
-            CREATE TABLE IF NOT EXISTS sessionstore (
-              id varchar(40),
-              data bytea
-            );
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = 'sessionstore'::regclass AND contype = 'p'
             """)
-        cr.commit()
+        if cr.rowcount:
+            return
+        _logger.info('Adding primary key to sessions table')
+        # previous versions could save the same sid twice
+        cr.execute(
+            """
+            DELETE FROM sessionstore s
+            USING sessionstore dup
+            WHERE s.id = dup.id AND s.ctid < dup.ctid
+            """)
+        cr.execute("DELETE FROM sessionstore WHERE id IS NULL")
+        cr.execute("ALTER TABLE sessionstore ADD PRIMARY KEY (id)")
 
-        return cr
+    def _migrate_columns(self, cr):
+        """Add columns missed in tables created by previous versions."""
+        cr.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'sessionstore'
+            """)
+        columns = [row[0] for row in cr.fetchall()]
+        for column, definition in COLUMNS:
+            if column in columns:
+                continue
+            _logger.info('Adding column %s to sessions table', column)
+            cr.execute("ALTER TABLE sessionstore ADD COLUMN %s %s" % (column, definition))
+        if 'db' not in columns:
+            self._fill_owner(cr)
+
+    def _fill_owner(self, cr):
+        """Fill uid and db columns of existing sessions from their content."""
+        last_sid = ''
+        while True:
+            cr.execute(
+                """
+                SELECT id, data FROM sessionstore
+                WHERE id > %s ORDER BY id LIMIT %s
+                """, (last_sid, MIGRATION_BATCH_SIZE))
+            rows = cr.fetchall()
+            if not rows:
+                break
+            values = []
+            for sid, payload in rows:
+                try:
+                    data = self.serializer.loads(payload)
+                except Exception:
+                    continue
+                values.append((data.get('uid'), data.get('db'), sid))
+            cr.executemany("UPDATE sessionstore SET uid = %s, db = %s WHERE id = %s", values)
+            last_sid = rows[-1][0]
+
+    def _create_table(self, cr):
+        columns = ['id varchar(40) PRIMARY KEY', 'data bytea'] + ['%s %s' % c for c in COLUMNS]
+        if self.partitions:
+            # partitioned table itself cannot be unlogged, only its partitions
+            cr.execute("CREATE TABLE sessionstore (%s) PARTITION BY HASH (id)" % ', '.join(columns))
+            for remainder in range(self.partitions):
+                cr.execute(
+                    """
+                    CREATE %s TABLE sessionstore_p%d PARTITION OF sessionstore
+                    FOR VALUES WITH (MODULUS %d, REMAINDER %d)
+                    """ % ('UNLOGGED' if self.unlogged else '', remainder, self.partitions, remainder))
+        else:
+            cr.execute("CREATE %s TABLE sessionstore (%s)" % (
+                'UNLOGGED' if self.unlogged else '', ', '.join(columns)))
+
+    def _migrate_layout(self, cr):
+        """Apply partitioning and logging mode from config to existing table."""
+        cr.execute(
+            """
+            SELECT c.relkind = 'p', count(i.inhrelid)
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhparent = c.oid
+            WHERE c.oid = 'sessionstore'::regclass
+            GROUP BY c.relkind
+            """)
+        partitioned, partitions = cr.fetchone()
+        if partitioned != bool(self.partitions) or partitions != self.partitions:
+            self._rebuild_table(cr)
+            return
+
+        cr.execute(
+            """
+            SELECT c.relname, c.relpersistence
+            FROM pg_class c
+            WHERE c.relkind = 'r' AND (
+                c.oid = 'sessionstore'::regclass
+                OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'sessionstore'::regclass)
+            )
+            """)
+        for relname, persistence in cr.fetchall():
+            if (persistence == 'u') == self.unlogged:
+                continue
+            _logger.info('Switching table %s to %s mode', relname, 'unlogged' if self.unlogged else 'logged')
+            cr.execute('ALTER TABLE "%s" SET %s' % (relname, 'UNLOGGED' if self.unlogged else 'LOGGED'))
+
+    def _rebuild_table(self, cr):
+        """Recreate sessions table with new partitioning, keeping the sessions."""
+        _logger.info('Recreating sessions table with %s partitions', self.partitions)
+        columns = ', '.join(['id', 'data'] + [c[0] for c in COLUMNS])
+        cr.execute("CREATE TEMP TABLE sessionstore_migration ON COMMIT DROP AS SELECT %s FROM sessionstore" % columns)
+        cr.execute("DROP TABLE sessionstore")
+        self._create_table(cr)
+        cr.execute("INSERT INTO sessionstore (%s) SELECT %s FROM sessionstore_migration" % (columns, columns))
 
     def is_valid_key(self, key):
         with self.get_cursor() as cr:
@@ -66,50 +302,236 @@ class PostgresSessionStore(SessionStore):
                        (key,))
             return cr.rowcount == 1
 
+    def _get_state(self, session):
+        """Return digest of the payload and uid the session had when it was loaded or saved."""
+        # values are kept in __dict__ to bypass OpenERPSession.__setattr__,
+        # which would put them into session data
+        sid, digest, uid = vars(session).get(STATE_ATTR, (None, None, None))
+        if sid != session.sid:
+            # new session or sid was rotated
+            return None, None
+        return digest, uid
+
+    def _set_state(self, session, data):
+        vars(session)[STATE_ATTR] = (session.sid, hashlib.sha1(data).digest(), session.get('uid'))
+
     def save(self, session):
-        with self.get_cursor() as cr:
-            sql_data = {
-                'data': psycopg2.Binary(pickle.dumps(dict(session),
-                                                     pickle.HIGHEST_PROTOCOL)),
-                'id': session.sid,
-            }
+        data = self.serializer.dumps(dict(session))
+        digest, uid = self._get_state(session)
+        if digest == hashlib.sha1(data).digest():
+            # nothing is changed since session was loaded
+            return
+        values = (data, session.get('uid'), session.get('db'))
+        # new sessions, login and logout are saved synchronously
+        if self.write_behind and digest and uid == session.get('uid'):
+            if self._get_writer().put(session.sid, values):
+                self._set_state(session, data)
+                return
+        self._discard_pending([session.sid])
+        self._write_many([(session.sid,) + values])
+        self._set_state(session, data)
+
+    def save_many(self, sessions):
+        """Save several sessions by one statement."""
+        items = OrderedDict()
+        for session in sessions:
+            items[session.sid] = (self.serializer.dumps(dict(session)), session.get('uid'), session.get('db'))
+        self._discard_pending(list(items))
+        self._write_many([(sid,) + values for sid, values in items.items()])
+        for session in sessions:
+            self._set_state(session, items[session.sid][0])
 
-            if self.is_valid_key(session.sid):
+    def _write_many(self, items, insert=True):
+        """Write sessions by one statement.
+
+        :param items: list of (sid, payload, uid, db) with unique sids
+        :param insert: if False, only existing sessions are updated, so
+                       sessions deleted in the meantime are not restored
+        """
+        if not items:
+            return
+        # rows are locked in the same order by concurrent writers to avoid deadlocks
+        items = sorted(items, key=lambda item: item[0])
+        params = []
+        for sid, data, uid, db in items:
+            params += [sid, psycopg2.Binary(data), uid, db]
+        with self.get_cursor() as cr:
+            if insert:
                 cr.execute(
                     """
-                    UPDATE sessionstore SET data = %(data)s WHERE id = %(id)s;
-                    """, sql_data)
+                    INSERT INTO sessionstore (id, data, uid, db)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE
+                    SET data = EXCLUDED.data,
+                        uid = EXCLUDED.uid,
+                        db = EXCLUDED.db,
+                        last_access = EXCLUDED.last_access,
+                        version = sessionstore.version + 1
+                    RETURNING id, version;
+                    """ % ', '.join(['(%s, %s, %s, %s)'] * len(items)), params)
             else:
+                # order of rows updated by a join is not defined, so they are locked first
+                cr.execute(
+                    """
+                    SELECT id FROM sessionstore WHERE id = ANY(%s) ORDER BY id FOR UPDATE;
+                    """, ([item[0] for item in items],))
                 cr.execute(
                     """
-                    INSERT INTO sessionstore (id, data)
-                    VALUES (%(id)s, %(data)s);
-                    """, sql_data)
-            cr.commit()
+                    UPDATE sessionstore s
+                    SET data = v.data,
+                        uid = v.uid,
+                        db = v.db,
+                        last_access = (now() at time zone 'UTC'),
+                        version = s.version + 1
+                    FROM (VALUES %s) AS v (id, data, uid, db)
+                    WHERE s.id = v.id
+                    RETURNING s.id, s.version;
+                    """ % ', '.join(['(%s, %s::bytea, %s::integer, %s::varchar)'] * len(items)), params)
+            versions = dict(cr.fetchall())
+        if self.cache is not None:
+            for sid, data, uid, db in items:
+                if sid in versions:
+                    self.cache.set(sid, versions[sid], data)
+                else:
+                    self.cache.pop(sid)
+
+    def delete_by_uid(self, db, uid):
+        """Delete all sessions of the user.
+
+        :param uid: user id or list of ids
+        :returns int: number of deleted sessions
+        """
+        uids = uid if isinstance(uid, (list, tuple)) else [uid]
+        return self._delete_where("db = %s AND uid = ANY(%s)", (db, list(uids)))
+
+    def delete_by_db(self, db):
+        """Delete all sessions of the database.
+
+        :returns int: number of deleted sessions
+        """
+        return self._delete_where("db = %s", (db,))
+
+    def _delete_where(self, condition, params):
+        writer = self._get_active_writer()
+        if writer:
+            # pending sessions must not be written after deletion
+            writer.flush()
+        with self.get_cursor() as cr:
+            cr.execute("DELETE FROM sessionstore WHERE %s;" % condition, params)
+            deleted = cr.rowcount
+        if self.cache is not None:
+            self.cache.clear()
+        _logger.info('%s sessions are deleted', deleted)
+        return deleted
 
     def delete(self, session):
+        self._discard_pending([session.sid])
         with self.get_cursor() as cr:
             cr.execute("DELETE FROM sessionstore WHERE id = %s;",
                        (session.sid,))
+        vars(session).pop(STATE_ATTR, None)
+        if self.cache is not None:
+            self.cache.pop(session.sid)
 
     def get(self, sid):
+        writer = self._get_active_writer()
+        pending = writer and writer.get(sid)
+        if pending is not None:
+            # session is not written yet
+            return self._make_session(sid, pending[0])
+
+        entry = self.cache.get(sid) if self.cache is not None else None
+        if entry and time.time() - entry.validated_at < self.cache_staleness:
+            return self._make_session(sid, entry.payload)
+
         with self.get_cursor() as cr:
+            # payload is not fetched when cached version is still actual
             cr.execute(
                 """
-                SELECT data FROM sessionstore WHERE id = %s LIMIT 1;
-                """, (sid,))
+                SELECT CASE WHEN version = %(version)s THEN NULL ELSE data END,
+                       version,
+                       last_access < (now() at time zone 'UTC') - %(touch_interval)s * interval '1 second'
+                FROM sessionstore
+                WHERE id = %(id)s
+                  AND last_access >= (now() at time zone 'UTC') - %(max_age)s * interval '1 second';
+                """, {
+                    'id': sid,
+                    'version': entry.version if entry else None,
+                    'touch_interval': self.touch_interval,
+                    'max_age': self.max_age,
+                })
 
             if cr.rowcount != 1:
+                if entry:
+                    self.cache.pop(sid)
                 return self.new()
 
-            result = cr.fetchone()
+            payload, version, touch = cr.fetchone()
+            if touch:
+                self._touch(cr, sid)
+
+        payload = entry.payload if payload is None else bytes(payload)
+        if self.cache is not None:
+            self.cache.set(sid, version, payload)
+        return self._make_session(sid, payload)
+
+    def _touch(self, cr, sid):
+        """Update last access time of the session.
+
+        It's not critical, so reading the session doesn't fail if the row is
+        locked by a concurrent save, which updates the time anyway.
+        """
+        try:
+            with cr.savepoint():
+                cr.execute(
+                    """
+                    UPDATE sessionstore SET last_access = (now() at time zone 'UTC')
+                    WHERE id IN (
+                        SELECT id FROM sessionstore WHERE id = %s FOR UPDATE SKIP LOCKED
+                    );
+                    """, (sid,))
+        except psycopg2.extensions.TransactionRollbackError:
+            _logger.warning('Last access time of session %s is not updated', sid, exc_info=True)
+
+    def _make_session(self, sid, payload):
+        try:
+            data = self.serializer.loads(payload)
+        except Exception:
+            data = {}
+
+        session = self.session_class(data, sid, False)
+        self._set_state(session, payload)
+        return session
+
+    def gc(self, max_batches=None):
+        """Delete expired sessions.
 
-            try:
-                data = pickle.loads(result[0])
-            except Exception:
-                data = {}
+        Each batch is deleted in a separate transaction to keep locks short.
 
-            return self.session_class(data, sid, False)
+        :param max_batches: stop after that number of batches. No limit by default
+        :returns int: number of deleted sessions
+        """
+        deleted = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            with self.get_cursor() as cr:
+                cr.execute(
+                    """
+                    DELETE FROM sessionstore WHERE id IN (
+                        SELECT id FROM sessionstore
+                        WHERE last_access < (now() at time zone 'UTC') - %s * interval '1 second'
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    );
+                    """, (self.max_age, self.gc_batch_size))
+                count = cr.rowcount
+            deleted += count
+            batches += 1
+            if count < self.gc_batch_size:
+                break
+        if deleted:
+            _logger.info('%s expired sessions are deleted', deleted)
+        return deleted
 
     def list(self):
         with self.get_cursor() as cr:
@@ -0,0 +1,142 @@
+import pickle
+
+from unittest.mock import patch
+
+from odoo.tests.common import BaseCase
+
+from ..cache import LRUCache
+from ..serializers import JSON, PICKLE, ZLIB, Serializer
+from ..writer import SessionWriter
+
+
+class TestLRUCache(BaseCase):
+
+    def test_eviction(self):
+        cache = LRUCache(max_entries=2, max_bytes=10, ttl=60)
+        cache.set('a', 1, b'aaa')
+        cache.set('b', 1, b'bbb')
+        # 'a' becomes recently used
+        self.assertEqual(cache.get('a').payload, b'aaa')
+        cache.set('c', 1, b'ccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+        # limit of total size
+        cache.set('d', 1, b'dddddddd')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('d').version, 1)
+
+        # payload bigger than the limit is not cached
+        cache.set('d', 2, b'x' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        cache = LRUCache(max_entries=10, max_bytes=100, ttl=60)
+        with patch('time.time', return_value=1000.0):
+            cache.set('a', 1, b'aaa')
+        with patch('time.time', return_value=1060.0):
+            self.assertIsNotNone(cache.get('a'))
+        with patch('time.time', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class FakeStore(object):
+
+    def __init__(self, fail_sids=()):
+        self.fail_sids = set(fail_sids)
+        self.calls = []
+
+    def _write_many(self, items, insert=True):
+        if any(item[0] in self.fail_sids for item in items):
+            raise ValueError('Test error')
+        self.calls.append((items, insert))
+
+
+class TestSessionWriter(BaseCase):
+
+    def test_coalesce(self):
+        store = FakeStore()
+        writer = SessionWriter(store, max_queue=2)
+        self.assertTrue(writer.put('b', (b'1', 1, 'db')))
+        self.assertTrue(writer.put('a', (b'1', 1, 'db')))
+        self.assertTrue(writer.put('b', (b'2', 1, 'db')))
+        # queue is full, the session must be saved synchronously
+        self.assertFalse(writer.put('c', (b'1', 1, 'db')))
+        self.assertEqual(writer.get('b'), (b'2', 1, 'db'))
+
+        writer.flush()
+        self.assertEqual(store.calls, [([('b', b'2', 1, 'db'), ('a', b'1', 1, 'db')], False)])
+        self.assertIsNone(writer.get('b'))
+        writer.flush()
+        self.assertEqual(len(store.calls), 1)
+
+    def test_discard(self):
+        store = FakeStore()
+        writer = SessionWriter(store)
+        writer.put('a', (b'1', 1, 'db'))
+        writer.put('b', (b'1', 1, 'db'))
+        writer.discard(['a'])
+        self.assertIsNone(writer.get('a'))
+        writer.flush()
+        self.assertEqual(store.calls, [([('b', b'1', 1, 'db')], False)])
+
+    def test_failed_batch(self):
+        store = FakeStore(fail_sids=['b'])
+        writer = SessionWriter(store)
+        for sid in 'abc':
+            writer.put(sid, (b'1', 1, 'db'))
+        writer.flush()
+        # only the broken session is lost
+        self.assertEqual(sorted(items[0][0] for items, insert in store.calls), ['a', 'c'])
+
+    def test_stop(self):
+        store = FakeStore()
+        writer = SessionWriter(store)
+        writer.put('a', (b'1', 1, 'db'))
+        writer.stop()
+        self.assertEqual(len(store.calls), 1)
+        self.assertFalse(writer.put('b', (b'1', 1, 'db')))
+
+
+class TestSerializer(BaseCase):
+
+    def test_json(self):
+        serializer = Serializer('json')
+        payload = serializer.dumps({'uid': 1, 'context': {'lang': 'en_US'}})
+        self.assertEqual(payload[0], JSON)
+        self.assertEqual(serializer.loads(payload), {'uid': 1, 'context': {'lang': 'en_US'}})
+
+        # JSON doesn't keep tuples and integer keys
+        data = serializer.loads(serializer.dumps({'ids': (1, 2), 'map': {1: 'a'}}))
+        self.assertEqual(data, {'ids': [1, 2], 'map': {'1': 'a'}})
+
+    def test_fallback_to_pickle(self):
+        serializer = Serializer('json')
+        payload = serializer.dumps({'ids': {1, 2}})
+        self.assertEqual(payload[0], PICKLE)
+        self.assertEqual(serializer.loads(payload), {'ids': {1, 2}})
+
+    def test_compression(self):
+        serializer = Serializer('pickle', compression='zlib', threshold=100)
+        small = serializer.dumps({'a': 1})
+        self.assertEqual(small[0], PICKLE)
+        data = {'a': 'x' * 1000}
+        payload = serializer.dumps(data)
+        self.assertEqual(payload[0], PICKLE | ZLIB)
+        self.assertLess(len(payload), 1000)
+        # other settings don't prevent reading
+        self.assertEqual(Serializer('json').loads(payload), data)
+
+    def test_legacy_pickle(self):
+        data = {'uid': 1, 'ids': (1, 2)}
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(Serializer('json').loads(pickle.dumps(data, protocol)), data)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            Serializer('yaml')
+        with self.assertRaises(ValueError):
+            Serializer().loads(bytes([0x0e]) + b'data')
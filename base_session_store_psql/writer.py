@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+
+class SessionWriter(threading.Thread):
+    """Background thread saving sessions to the store.
+
+    Several saves of the same session are coalesced and only the last one is
+    written. Pending sessions are flushed by one statement. Only existing
+    sessions are updated, so deleted sessions are not restored by the flush.
+    """
+
+    def __init__(self, store, max_queue=1000, interval=0.1):
+        super(SessionWriter, self).__init__(name='SessionWriter')
+        self.daemon = True
+        self.store = store
+        self.max_queue = max_queue
+        # time to wait for more saves before flushing, in seconds
+        self.interval = interval
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._stopped = False
+        self._cond = threading.Condition()
+        # held while batch is written, so discard() can wait for it
+        self._flush_lock = threading.Lock()
+
+    def put(self, sid, values):
+        """Queue session.
+
+        :param values: tuple of (payload, uid, db)
+        :returns bool: False if queue is full and session must be saved synchronously
+        """
+        with self._cond:
+            if self._stopped:
+                return False
+            if sid not in self._pending and len(self._pending) >= self.max_queue:
+                return False
+            self._pending[sid] = values
+            self._cond.notify()
+            return True
+
+    def get(self, sid):
+        """Return values of the session that is not written yet or None."""
+        with self._cond:
+            values = self._pending.get(sid)
+            if values is None:
+                values = self._in_flight.get(sid)
+            return values
+
+    def discard(self, sids):
+        """Forget pending payloads, e.g. because sessions are deleted."""
+        with self._flush_lock, self._cond:
+            for sid in sids:
+                self._pending.pop(sid, None)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, OrderedDict()
+                self._in_flight = batch
+            try:
+                if batch:
+                    self._write(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = {}
+
+    def _write(self, batch):
+        items = [(sid,) + values for sid, values in batch.items()]
+        try:
+            self.store._write_many(items, insert=False)
+            return
+        except Exception:
+            _logger.warning('Failed to save %s sessions at once, saving them one by one', len(items), exc_info=True)
+        # one broken session must not lose changes of the others
+        for item in items:
+            try:
+                self.store._write_many([item], insert=False)
+            except Exception:
+                _logger.exception('Failed to save session %s', item[0])
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join(timeout=5)
+        self.flush()
@@ -0,0 +1,2 @@
+def post_load():
+    from . import http
@@ -0,0 +1,30 @@
+{
+    "name": """Store sessions in redis""",
+    "summary": """Keeps sessions out of main database with native expiration""",
+    "category": "Extra Tools",
+    "images": [],
+    "version": "1.0.1",
+
+    "author": "IT-Projects LLC, Ivan Yelizariev",
+    "website": "https://it-projects.info",
+    "license": "AGPL-3",
+    # "price": 9.00,
+    # "currency": "EUR",
+
+    "depends": [
+        "base_session_store_psql",
+    ],
+    "external_dependencies": {"python": ["redis"], "bin": []},
+    "data": [
+    ],
+    "qweb": [
+    ],
+    "demo": [
+    ],
+
+    "post_load": 'post_load',
+    "pre_init_hook": None,
+    "post_init_hook": None,
+    "installable": True,
+    "auto_install": False,
+}
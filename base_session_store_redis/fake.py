@@ -0,0 +1,150 @@
+import fnmatch
+import threading
+import time
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FakeRedis(object):
+    """In-process replacement of ``redis.StrictRedis`` for tests.
+
+    Supports only commands used by ``RedisSessionStore``. Keys are expired
+    lazily on access.
+
+    :param clock: function returning current time, in seconds
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._data = {}
+        self._expire_at = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, name):
+        expire_at = self._expire_at.get(name)
+        if expire_at is not None and expire_at <= self.clock():
+            self._data.pop(name, None)
+            self._expire_at.pop(name, None)
+        return name in self._data
+
+    def get(self, name):
+        with self._lock:
+            if not self._alive(name):
+                return None
+            return self._data[name]
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = _to_bytes(value)
+            self._expire_at.pop(name, None)
+            if ex:
+                self._expire_at[name] = self.clock() + ex
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            count = 0
+            for name in names:
+                if self._alive(name):
+                    count += 1
+                self._data.pop(name, None)
+                self._expire_at.pop(name, None)
+            return count
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._alive(name))
+
+    def expire(self, name, time):
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expire_at[name] = self.clock() + time
+            return True
+
+    def sadd(self, name, *values):
+        with self._lock:
+            if not self._alive(name):
+                self._data[name] = set()
+            members = self._data[name]
+            values = set(_to_bytes(v) for v in values)
+            added = len(values - members)
+            members.update(values)
+            return added
+
+    def smembers(self, name):
+        with self._lock:
+            if not self._alive(name):
+                return set()
+            return set(self._data[name])
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            if not self._alive(name):
+                self._data[name] = {}
+            members = self._data[name]
+            added = 0
+            for value, score in mapping.items():
+                value = _to_bytes(value)
+                added += value not in members
+                members[value] = float(score)
+            return added
+
+    def zrem(self, name, *values):
+        with self._lock:
+            if not self._alive(name):
+                return 0
+            members = self._data[name]
+            return sum(1 for v in values if members.pop(_to_bytes(v), None) is not None)
+
+    def zrangebyscore(self, name, min, max):
+        with self._lock:
+            if not self._alive(name):
+                return []
+            items = sorted(self._data[name].items(), key=lambda item: item[1])
+            return [value for value, score in items if float(min) <= score <= float(max)]
+
+    def zremrangebyscore(self, name, min, max):
+        with self._lock:
+            if not self._alive(name):
+                return 0
+            members = self._data[name]
+            removed = [value for value, score in members.items() if float(min) <= score <= float(max)]
+            for value in removed:
+                del members[value]
+            return len(removed)
+
+    def scan_iter(self, match=None):
+        with self._lock:
+            names = [name for name in list(self._data) if self._alive(name)]
+        for name in names:
+            if match is None or fnmatch.fnmatchcase(name, match):
+                yield _to_bytes(name)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
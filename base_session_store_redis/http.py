@@ -0,0 +1,30 @@
+import logging
+
+import odoo
+from odoo.tools.func import lazy_property
+
+from .redisstore import RedisSessionStore
+
+_logger = logging.getLogger(__name__)
+
+
+class RootTkobr(odoo.http.Root):
+
+    @lazy_property
+    def session_store(self):
+        # Setup http sessions
+        _logger.debug('HTTP sessions stored in Redis')
+        return RedisSessionStore(session_class=odoo.http.OpenERPSession)
+
+
+def session_gc(session_store):
+    if not isinstance(session_store, RedisSessionStore):
+        return session_gc_origin(session_store)
+    # sessions are expired by redis
+
+
+session_gc_origin = odoo.http.session_gc
+odoo.http.session_gc = session_gc
+
+root = RootTkobr()
+odoo.http.root.session_store = root.session_store
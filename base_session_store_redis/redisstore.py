@@ -0,0 +1,167 @@
+import logging
+import time
+
+from odoo.tools import config
+
+from werkzeug.contrib.sessions import SessionStore
+
+from odoo.addons.base_session_store_psql.serializers import Serializer
+
+from .fake import FakeRedis
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    _logger.debug('redis package is required which is not found on your installation')
+
+FAKE_URL = 'fake://'
+
+
+class RedisSessionStore(SessionStore):
+    """Keep sessions in redis.
+
+    Sessions expire after ``max_age`` seconds of inactivity, the same way as
+    in ``PostgresSessionStore``, but expiration is done by redis itself.
+    Sids are also added to sorted sets per database and per user to delete
+    sessions in bulk. Sids are scored by time of last access, so sids of
+    expired sessions are trimmed from the sets on saving.
+
+    :param clock: function returning current time, in seconds
+    """
+
+    def __init__(self, session_class=None, client=None, max_age=None, clock=time.time):
+        super(RedisSessionStore, self).__init__(session_class=session_class)
+        self.clock = clock
+        self.prefix = config.get('session_store_redis_prefix', 'session:')
+        self.max_age = max_age or int(config.get('session_store_max_age', 7 * 24 * 60 * 60))
+        self.serializer = Serializer(
+            serializer=config.get('session_store_serializer', 'pickle'),
+            compression=config.get('session_store_compression') or None,
+            threshold=int(config.get('session_store_compression_threshold', 1024)),
+        )
+        self.client = client or self._get_client()
+
+    def _get_client(self):
+        url = config.get('session_store_redis_url', 'redis://localhost:6379/0')
+        if url == FAKE_URL:
+            _logger.warning('Sessions are stored in memory of the process. Use it for tests only')
+            return FakeRedis()
+        # connection pool of redis-py is recreated after fork by itself
+        pool = redis.ConnectionPool.from_url(
+            url,
+            max_connections=int(config.get('session_store_redis_maxconn', 8)),
+        )
+        return redis.StrictRedis(connection_pool=pool)
+
+    def _key(self, sid):
+        return '%ss:%s' % (self.prefix, sid)
+
+    def _db_key(self, db):
+        return '%sdb:%s' % (self.prefix, db)
+
+    def _uid_key(self, db, uid):
+        return '%suid:%s:%s' % (self.prefix, db, uid)
+
+    def is_valid_key(self, key):
+        return bool(self.client.exists(self._key(key)))
+
+    def save(self, session):
+        self.save_many([session])
+
+    def save_many(self, sessions):
+        """Save several sessions in one round-trip."""
+        now = self.clock()
+        pipe = self.client.pipeline(transaction=False)
+        for session in sessions:
+            pipe.set(self._key(session.sid), self.serializer.dumps(dict(session)), ex=self.max_age)
+            for key in self._index_keys(session):
+                pipe.zadd(key, {session.sid: now})
+                pipe.zremrangebyscore(key, '-inf', now - self.max_age)
+                pipe.expire(key, self.max_age)
+        pipe.execute()
+
+    def _index_keys(self, session):
+        db = session.get('db')
+        if not db:
+            return []
+        keys = [self._db_key(db)]
+        if session.get('uid'):
+            keys.append(self._uid_key(db, session['uid']))
+        return keys
+
+    def delete(self, session):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(self._key(session.sid))
+        for key in self._index_keys(session):
+            pipe.zrem(key, session.sid)
+        pipe.execute()
+
+    def get(self, sid):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self._key(sid))
+        # sliding expiration
+        pipe.expire(self._key(sid), self.max_age)
+        payload = pipe.execute()[0]
+        if payload is None:
+            return self.new()
+
+        try:
+            data = self.serializer.loads(payload)
+        except Exception:
+            data = {}
+
+        session = self.session_class(data, sid, False)
+        # session stays in the indexes as long as it's used
+        index_keys = self._index_keys(session)
+        if index_keys:
+            now = self.clock()
+            pipe = self.client.pipeline(transaction=False)
+            for key in index_keys:
+                pipe.zadd(key, {sid: now})
+                pipe.expire(key, self.max_age)
+            pipe.execute()
+        return session
+
+    def delete_by_uid(self, db, uid):
+        """Delete all sessions of the user.
+
+        :param uid: user id or list of ids
+        :returns int: number of deleted sessions
+        """
+        uids = uid if isinstance(uid, (list, tuple)) else [uid]
+        return self._delete_index([self._uid_key(db, u) for u in uids])
+
+    def delete_by_db(self, db):
+        """Delete all sessions of the database.
+
+        :returns int: number of deleted sessions
+        """
+        return self._delete_index([self._db_key(db)])
+
+    def _delete_index(self, index_keys):
+        pipe = self.client.pipeline(transaction=False)
+        for key in index_keys:
+            pipe.zrangebyscore(key, self.clock() - self.max_age, '+inf')
+        sids = set()
+        for members in pipe.execute():
+            sids.update(members)
+        keys = [self._key(sid.decode() if isinstance(sid, bytes) else sid) for sid in sids]
+        deleted = 0
+        if keys:
+            deleted = self.client.delete(*keys)
+        self.client.delete(*index_keys)
+        _logger.info('%s sessions are deleted', deleted)
+        return deleted
+
+    def gc(self, max_batches=None):
+        """Sessions are expired by redis. Kept for compatibility with PostgresSessionStore."""
+        return 0
+
+    def list(self):
+        start = len(self._key(''))
+        return [
+            (key.decode() if isinstance(key, bytes) else key)[start:]
+            for key in self.client.scan_iter(match=self._key('*'))
+        ]
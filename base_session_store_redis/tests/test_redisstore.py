@@ -0,0 +1,102 @@
+from werkzeug.contrib.sessions import Session
+
+from odoo.tests.common import BaseCase
+
+from ..fake import FakeRedis
+from ..redisstore import RedisSessionStore
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRedisSessionStore(BaseCase):
+
+    def setUp(self):
+        super(TestRedisSessionStore, self).setUp()
+        self.clock = Clock()
+        self.store = RedisSessionStore(
+            session_class=Session,
+            client=FakeRedis(clock=self.clock),
+            max_age=60,
+            clock=self.clock,
+        )
+
+    def _create_session(self, db='db1', uid=None):
+        session = self.store.new()
+        session.update({'db': db, 'uid': uid, 'context': {'lang': 'en_US'}})
+        self.store.save(session)
+        return session
+
+    def test_save_get_delete(self):
+        session = self._create_session(uid=7)
+        self.assertTrue(self.store.is_valid_key(session.sid))
+        self.assertEqual(self.store.list(), [session.sid])
+
+        loaded = self.store.get(session.sid)
+        self.assertFalse(loaded.new)
+        self.assertEqual(dict(loaded), dict(session))
+
+        self.store.delete(loaded)
+        self.assertFalse(self.store.is_valid_key(session.sid))
+        self.assertTrue(self.store.get(session.sid).new)
+
+    def test_expiration(self):
+        session = self._create_session()
+        self.clock.now += 50
+        # access prolongs the session
+        self.assertFalse(self.store.get(session.sid).new)
+        self.clock.now += 50
+        self.assertFalse(self.store.get(session.sid).new)
+        self.clock.now += 61
+        self.assertTrue(self.store.get(session.sid).new)
+
+    def test_delete_by_uid(self):
+        session1 = self._create_session(uid=7)
+        session2 = self._create_session(uid=7)
+        other_user = self._create_session(uid=8)
+        other_db = self._create_session(db='db2', uid=7)
+
+        self.assertEqual(self.store.delete_by_uid('db1', 7), 2)
+        self.assertFalse(self.store.is_valid_key(session1.sid))
+        self.assertFalse(self.store.is_valid_key(session2.sid))
+        self.assertTrue(self.store.is_valid_key(other_user.sid))
+        self.assertTrue(self.store.is_valid_key(other_db.sid))
+
+    def test_delete_by_db(self):
+        session1 = self._create_session(uid=7)
+        anonymous = self._create_session()
+        other_db = self._create_session(db='db2', uid=7)
+
+        self.assertEqual(self.store.delete_by_db('db1'), 2)
+        self.assertFalse(self.store.is_valid_key(session1.sid))
+        self.assertFalse(self.store.is_valid_key(anonymous.sid))
+        self.assertTrue(self.store.is_valid_key(other_db.sid))
+
+    def test_index_cleanup(self):
+        session = self._create_session(uid=7)
+        uid_key = self.store._uid_key('db1', 7)
+        self.store.delete(session)
+        self.assertFalse(self.store.client.zrangebyscore(uid_key, '-inf', '+inf'))
+
+        expired = self._create_session(uid=7)
+        self.clock.now += 61
+        self._create_session(uid=7)
+        # sid of expired session is trimmed
+        members = self.store.client.zrangebyscore(uid_key, '-inf', '+inf')
+        self.assertNotIn(expired.sid.encode(), members)
+        self.assertEqual(len(members), 1)
+
+    def test_delete_by_uid_after_reads(self):
+        session = self._create_session(uid=7)
+        # session is only read for longer than max_age
+        for i in range(3):
+            self.clock.now += 50
+            self.assertFalse(self.store.get(session.sid).new)
+        self.assertEqual(self.store.delete_by_uid('db1', 7), 1)
+        self.assertFalse(self.store.is_valid_key(session.sid))
@@ -1,13 +1,15 @@
 {
     'name': "Force move attachments to DB storage",
-    'version': '11.0.1.0.0',
+    'version': '11.0.1.3.0',
     'author': 'IT-Projects LLC, Ivan Yelizariev',
     'license': 'LGPL-3',
     'category': 'Tools',
     'website': 'https://yelizariev.github.io',
     'depends': ['attachment_large_object'],
     'data': [
-        'pre_install.xml'
+        'security/ir.model.access.csv',
+        'views/ir_attachment_storage_migration_views.xml',
+        'pre_install.xml',
     ],
     "auto_install": False,
     'installable': True,
@@ -1,19 +1,69 @@
 # Copyright 2018 Ivan Yelizariev <https://it-projects.info/team/yelizariev>
 # License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl.html).
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
 from openerp import api
+from openerp import fields
 from openerp import models
-from openerp.exceptions import AccessError
+from openerp.exceptions import AccessError, UserError
+from openerp.tools import config
 from openerp.tools.translate import _
 
+from openerp.addons.attachment_large_object.ir_attachment import (
+    CHUNK_SIZE, LARGE_OBJECT_LOCATION, b64decode_iter, b64encode_iter)
+
+_logger = logging.getLogger(__name__)
+
 STORAGE_KEY = 'ir_attachment.location'
 
+# SQL conditions of attachments that are not in the storage yet
+PENDING_CONDITIONS = {
+    'db': "store_fname IS NOT NULL",
+    'file': "(store_fname IS NULL AND db_datas IS NOT NULL) OR store_fname ~ '^[0-9]+$'",
+    LARGE_OBJECT_LOCATION: "(store_fname IS NULL AND db_datas IS NOT NULL) OR store_fname !~ '^[0-9]+$'",
+}
+
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 100
+# a worker stops after that number of seconds and continues on next call of the cron
+WORKER_RUN_TIME = 10 * 60
+# part of the real time limit of cron jobs that a worker may use
+WORKER_RUN_TIME_RATIO = 0.5
+# number of attachments per source storage moved by planner to estimate duration
+PLAN_SAMPLE_SIZE = 20
+# the sample is also limited by size and moving time
+PLAN_SAMPLE_BYTES = 50 * 1024 * 1024
+PLAN_SAMPLE_TIME = 30
+
+# SQL expression of the storage where the attachment is kept now
+CURRENT_STORAGE_SQL = """
+    CASE
+        WHEN store_fname IS NULL THEN 'db'
+        WHEN store_fname ~ '^[0-9]+$' THEN '%s'
+        ELSE 'file'
+    END
+""" % LARGE_OBJECT_LOCATION
+
 
 class IrConfigParameter(models.Model):
     _inherit = 'ir.config_parameter'
 
     @api.model
     def _attachment_force_storage(self, previous_value):
-        self.env['ir.attachment'].force_storage_previous(previous_value=previous_value)
+        if self.env.context.get('force_storage_sync'):
+            self.env['ir.attachment'].force_storage_previous(previous_value=previous_value)
+            return
+        if self.env['ir.attachment']._storage() not in PENDING_CONDITIONS:
+            # storage of other module: its content can be written by ORM only
+            self.env['ir.attachment'].force_storage_previous(previous_value=previous_value, recompute=True)
+            return
+        # don't block saving settings, attachments are moved by scheduled actions
+        self.env['ir.attachment'].queue_storage_migration()
 
     @api.model
     def create(self, vals):
@@ -55,7 +105,7 @@ class IrConfigParameter(models.Model):
 class IrAttachment(models.Model):
     _inherit = 'ir.attachment'
 
-    def force_storage_previous(self, previous_value=None):
+    def force_storage_previous(self, previous_value=None, recompute=False):
         """Force all attachments to be stored in the currently configured storage"""
         if not self.env.user._is_admin():
             raise AccessError(_('Only administrators can execute this action.'))
@@ -74,8 +124,445 @@ class IrAttachment(models.Model):
         # trick to disable addional filtering in ir.attachment's method _search
         domain += [('id', '!=', -1)]
 
-        for attach in self.search(domain):
-            # we add url because in some environment mimetype is not computed correctly
-            # see https://github.com/odoo/odoo/issues/11978
-            attach.write({'datas': attach.datas, 'url': attach.url})
+        self.search(domain)._move_to_storage(recompute=recompute)
         return True
+
+    @api.multi
+    def _move_to_storage(self, recompute=False, location=None):
+        """Move attachments to the currently configured storage
+
+        :param recompute: rewrite ``datas`` to recompute mimetype and
+                          ``index_content``. Otherwise the content is copied
+                          as is, chunk by chunk.
+        :param location: storage to copy content to. Default is the current
+                         one. Not used with ``recompute``. Content of storages
+                         unknown to this module is rewritten as with ``recompute``.
+        """
+        location = location or self._storage()
+        if recompute or location not in PENDING_CONDITIONS:
+            for attach in self:
+                # we add url because in some environment mimetype is not computed correctly
+                # see https://github.com/odoo/odoo/issues/11978
+                attach.write({'datas': attach.datas, 'url': attach.url})
+            return
+
+        for attach in self:
+            attach._copy_to_storage(location)
+        self.invalidate_cache(['store_fname', 'db_datas', 'checksum'])
+
+    @api.multi
+    def _get_current_storage(self):
+        """Return storage where the attachment is kept now"""
+        self.ensure_one()
+        if not self.store_fname:
+            return 'db'
+        if self.store_fname.isdigit():
+            return LARGE_OBJECT_LOCATION
+        return 'file'
+
+    @api.multi
+    def _copy_to_storage(self, location):
+        self.ensure_one()
+        source = self._get_current_storage()
+        if source == location:
+            return
+        if location not in PENDING_CONDITIONS:
+            raise UserError(_('Unsupported storage: %s') % location)
+        cr = self.env.cr
+        fname = self.store_fname
+        checksum = self.checksum
+        if source == 'db':
+            cr.execute('SELECT db_datas FROM ir_attachment WHERE id = %s', (self.id,))
+            db_datas = cr.fetchone()[0]
+            if not db_datas:
+                return
+            chunks = b64decode_iter(bytes(db_datas))
+        elif source == LARGE_OBJECT_LOCATION:
+            chunks = self._lobject_iter(cr, int(fname))
+        else:
+            chunks = self._file_iter(fname)
+
+        db_datas = None
+        store_fname = None
+        if location == 'db':
+            db_datas = b''.join(b64encode_iter(chunks))
+        elif location == LARGE_OBJECT_LOCATION:
+            store_fname = self._lobject_write(chunks, checksum)
+        else:
+            store_fname, checksum = self._file_write_chunks(chunks)
+        cr.execute("""
+            UPDATE ir_attachment
+            SET store_fname = %s, db_datas = %s, checksum = %s
+            WHERE id = %s
+        """, (store_fname, db_datas, checksum, self.id))
+        if fname:
+            self._file_delete(fname)
+
+    @api.model
+    def _file_iter(self, fname):
+        """Read file of the filestore in chunks"""
+        with open(self._full_path(fname), 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+    @api.model
+    def _file_write_chunks(self, chunks):
+        """Write content to the filestore without keeping it in memory
+
+        :returns tuple: file storage name and sha1 of the content
+        """
+        filestore = self._filestore()
+        if not os.path.isdir(filestore):
+            os.makedirs(filestore)
+        sha = hashlib.sha1()
+        fd, tmp_path = tempfile.mkstemp(dir=filestore, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    f.write(chunk)
+            checksum = sha.hexdigest()
+            fname, full_path = self._get_path(None, checksum)
+            if os.path.isfile(full_path):
+                os.unlink(tmp_path)
+            else:
+                os.rename(tmp_path, full_path)
+                # the file is deleted by gc if the transaction aborts
+                self._mark_for_gc(fname)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return fname, checksum
+
+    @api.model
+    def queue_storage_migration(self, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, recompute=False):
+        """Move attachments to the currently configured storage in background"""
+        if not self.env.user._is_admin():
+            raise AccessError(_('Only administrators can execute this action.'))
+        migration = self.env['ir.attachment.storage.migration'].create({
+            'location': self._storage(),
+            'workers': workers,
+            'batch_size': batch_size,
+            'recompute': recompute,
+        })
+        migration.action_start()
+        return migration
+
+
+class _DryRun(Exception):
+    pass
+
+
+class IrAttachmentStorageMigration(models.Model):
+    """Move attachments to another storage by scheduled actions.
+
+    Attachments are split between workers by ``id % workers`` and every
+    worker processes its attachments in batches ordered by id. Each batch is
+    committed together with id of its last attachment, so the migration can
+    be paused and continued from that point.
+    """
+    _name = 'ir.attachment.storage.migration'
+    _description = 'Attachments Storage Migration'
+    _order = 'id desc'
+
+    location = fields.Char(
+        'Storage', required=True, readonly=True,
+        default=lambda self: self.env['ir.attachment']._storage())
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('running', 'Running'),
+        ('paused', 'Paused'),
+        ('done', 'Done'),
+    ], default='draft', required=True, readonly=True)
+    workers = fields.Integer(
+        default=DEFAULT_WORKERS, required=True,
+        help='Number of parallel scheduled actions. Odoo needs at least that number of cron threads')
+    batch_size = fields.Integer(
+        default=DEFAULT_BATCH_SIZE, required=True, help='Number of attachments committed at once')
+    recompute = fields.Boolean('Recompute Mimetype and Index', help='Slower, because the content is decoded and parsed')
+    worker_ids = fields.One2many('ir.attachment.storage.migration.worker', 'migration_id', readonly=True)
+    total_count = fields.Integer('Attachments', readonly=True)
+    done_count = fields.Integer('Moved', compute='_compute_progress')
+    progress = fields.Float(compute='_compute_progress')
+    date_start = fields.Datetime(readonly=True)
+    date_end = fields.Datetime(readonly=True)
+    date_eta = fields.Datetime('Estimated End', compute='_compute_progress')
+    plan = fields.Text(readonly=True)
+    estimated_duration = fields.Float('Estimated Duration, hours', readonly=True)
+
+    _sql_constraints = [
+        ('workers_positive', 'CHECK (workers > 0 AND batch_size > 0)', 'Workers and batch size must be positive'),
+    ]
+
+    @api.multi
+    @api.depends('worker_ids.done_count', 'total_count', 'date_start')
+    def _compute_progress(self):
+        now = datetime.utcnow()
+        for r in self:
+            r.done_count = sum(r.worker_ids.mapped('done_count'))
+            r.progress = 100.0 * r.done_count / r.total_count if r.total_count else 0
+            r.date_eta = False
+            if r.state != 'running' or not r.done_count or not r.date_start:
+                continue
+            elapsed = now - fields.Datetime.from_string(r.date_start)
+            left = elapsed * (r.total_count - r.done_count) // r.done_count
+            r.date_eta = fields.Datetime.to_string(now + max(left, timedelta()))
+
+    @api.model
+    def _pending_query(self, location):
+        if location not in PENDING_CONDITIONS:
+            raise UserError(_('Unsupported storage: %s') % location)
+        return 'FROM ir_attachment WHERE (%s)' % PENDING_CONDITIONS[location]
+
+    @api.multi
+    def _get_plan(self, sample_size=PLAN_SAMPLE_SIZE, sample_bytes=PLAN_SAMPLE_BYTES, sample_time=PLAN_SAMPLE_TIME):
+        """Count attachments to be moved and estimate time of moving them.
+
+        Time is measured by moving random attachments of every source
+        storage one by one, until ``sample_size`` attachments,
+        ``sample_bytes`` bytes or ``sample_time`` seconds are reached.
+        The changes are rolled back.
+
+        :returns list: dicts with keys source, count, bytes, seconds, errors
+        """
+        self.ensure_one()
+        cr = self.env.cr
+        cr.execute("""
+            SELECT {storage} AS source, count(*), coalesce(sum(file_size), 0)
+            {query}
+            GROUP BY 1
+            ORDER BY 1
+        """.format(storage=CURRENT_STORAGE_SQL, query=self._pending_query(self.location)))
+        plan = [{'source': source, 'count': count, 'bytes': size} for source, count, size in cr.fetchall()]
+        attachments = self.env['ir.attachment']
+        for line in plan:
+            cr.execute("""
+                SELECT id, coalesce(file_size, 0) {query} AND {storage} = %s
+                ORDER BY random()
+                LIMIT %s
+            """.format(storage=CURRENT_STORAGE_SQL, query=self._pending_query(self.location)),
+                       (line['source'], sample_size))
+            moved = 0
+            moved_bytes = 0
+            line['errors'] = 0
+            start = time.time()
+            for attachment_id, size in cr.fetchall():
+                if moved and (moved_bytes + size > sample_bytes or time.time() - start > sample_time):
+                    break
+                try:
+                    with cr.savepoint():
+                        self._move_batch([attachment_id])
+                        raise _DryRun()
+                except _DryRun:
+                    pass
+                except Exception:
+                    _logger.warning('Storage migration %s: attachment %s fails on planning',
+                                    self.id, attachment_id, exc_info=True)
+                    line['errors'] += 1
+                attachments.invalidate_cache()
+                moved += 1
+                moved_bytes += size
+            line['seconds'] = (time.time() - start) / moved * line['count'] if moved else 0
+            line['sample'] = moved
+        return plan
+
+    @api.multi
+    def action_plan(self):
+        for r in self:
+            plan = r._get_plan()
+            seconds = sum(line['seconds'] for line in plan) / r.workers
+            lines = []
+            for line in plan:
+                text = _('%s -> %s: %s attachments, %.1f MB, %.1f min') % (
+                    line['source'], r.location, line['count'],
+                    line['bytes'] / 1024.0 ** 2, line['seconds'] / 60)
+                if line['errors']:
+                    text += _(', %s of %s sampled attachments failed') % (line['errors'], line['sample'])
+                lines.append(text)
+            r.write({
+                'plan': '\n'.join(lines) or _('Nothing to move'),
+                'estimated_duration': seconds / 3600,
+            })
+        return True
+
+    @api.multi
+    def _next_batch(self, index, last_id):
+        """Return ids of next attachments of the worker"""
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT id {query} AND id > %s AND id %% %s = %s
+            ORDER BY id
+            LIMIT %s
+        """.format(query=self._pending_query(self.location)), (last_id, self.workers, index, self.batch_size))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.multi
+    def _move_batch(self, ids):
+        self.env['ir.attachment'].browse(ids)._move_to_storage(recompute=self.recompute, location=self.location)
+
+    @api.multi
+    def action_start(self):
+        for r in self.filtered(lambda r: r.state == 'draft'):
+            r._pause_others()
+            self.env.cr.execute('SELECT count(*) ' + self._pending_query(r.location))
+            r.write({
+                'state': 'running',
+                'total_count': self.env.cr.fetchone()[0],
+                'date_start': fields.Datetime.now(),
+            })
+            for index in range(r.workers):
+                worker = self.env['ir.attachment.storage.migration.worker'].create({
+                    'migration_id': r.id,
+                    'index': index,
+                })
+                worker.cron_id = self.env['ir.cron'].sudo().create({
+                    'name': _('Attachments storage migration %s: worker %s') % (r.id, index),
+                    'model_id': self.env['ir.model']._get(worker._name).id,
+                    'state': 'code',
+                    'code': 'model.browse(%s)._run()' % worker.id,
+                    'user_id': self.env.ref('base.user_root').id,
+                    'interval_number': 1,
+                    'interval_type': 'minutes',
+                    'numbercall': -1,
+                    'nextcall': fields.Datetime.now(),
+                })
+        return True
+
+    @api.multi
+    def action_pause(self):
+        self.filtered(lambda r: r.state == 'running').write({'state': 'paused'})
+        self.mapped('worker_ids')._deactivate_cron()
+        return True
+
+    @api.multi
+    def action_resume(self):
+        for r in self.filtered(lambda r: r.state == 'paused'):
+            r._pause_others()
+            r.state = 'running'
+            r.worker_ids.filtered(lambda w: w.state == 'running').mapped('cron_id').sudo().write({
+                'active': True,
+                'nextcall': fields.Datetime.now(),
+            })
+        return True
+
+    @api.multi
+    def _pause_others(self):
+        """Pause other running migrations: attachments can't be moved to two storages at once"""
+        self.search([('state', '=', 'running'), ('id', 'not in', self.ids)]).action_pause()
+        stopped = self.search([('state', 'in', ['paused', 'done']), ('id', 'not in', self.ids)])
+        stopped.mapped('worker_ids')._deactivate_cron()
+
+    @api.multi
+    def _check_done(self):
+        for r in self:
+            if r.state == 'running' and all(w.state == 'done' for w in r.worker_ids):
+                r.write({'state': 'done', 'date_end': fields.Datetime.now()})
+                _logger.info('Attachments are moved to %s', r.location)
+
+
+class IrAttachmentStorageMigrationWorker(models.Model):
+    _name = 'ir.attachment.storage.migration.worker'
+    _description = 'Attachments Storage Migration Worker'
+    _order = 'migration_id, index'
+
+    migration_id = fields.Many2one('ir.attachment.storage.migration', required=True, ondelete='cascade')
+    index = fields.Integer(required=True)
+    state = fields.Selection([
+        ('running', 'Running'),
+        ('done', 'Done'),
+    ], default='running', required=True)
+    last_id = fields.Integer('Last Attachment ID', help='Attachments up to that id are processed')
+    done_count = fields.Integer('Moved')
+    failed_ids = fields.Text('Failed Attachments', help='Ids of attachments that were not moved because of errors')
+    cron_id = fields.Many2one('ir.cron', ondelete='set null')
+
+    @api.model
+    def _get_run_time(self):
+        """Return seconds a worker may run in one call of the cron.
+
+        In multiprocessing mode a cron job is killed after ``limit_time_real_cron``
+        seconds (``limit_time_real`` when it's not set), so the worker stops
+        well before that to commit its last batch.
+        """
+        limit = config.get('limit_time_real_cron')
+        if limit is None or limit < 0:
+            limit = config.get('limit_time_real')
+        if not config.get('workers') or not limit or limit <= 0:
+            return WORKER_RUN_TIME
+        return min(WORKER_RUN_TIME, limit * WORKER_RUN_TIME_RATIO)
+
+    @api.multi
+    def _run(self, max_time=None):
+        """Move batches of attachments until there is no more or time is over"""
+        self.ensure_one()
+        migration = self.migration_id
+        if max_time is None:
+            max_time = self._get_run_time()
+        started = time.time()
+        while time.time() - started < max_time:
+            # state may be changed by other transaction
+            self.invalidate_cache()
+            migration.invalidate_cache()
+            if migration.state != 'running' or self.state != 'running':
+                break
+            ids = migration._next_batch(self.index, self.last_id)
+            if not ids:
+                self.state = 'done'
+                migration._check_done()
+                # crons of workers that are still running must stay active
+                migration.worker_ids.filtered(lambda w: w.state == 'done')._deactivate_cron()
+                self.env.cr.commit()
+                break
+            batch_start = time.time()
+            failed = self._move_batch(ids)
+            self.write({
+                'last_id': ids[-1],
+                'done_count': self.done_count + len(ids) - len(failed),
+                'failed_ids': ','.join(filter(None, [self.failed_ids] + [str(i) for i in failed])) or False,
+            })
+            self.env.cr.commit()
+            _logger.info('Storage migration %s, worker %s: %s attachments are moved in %.1f s, last id %s',
+                         migration.id, self.index, len(ids), time.time() - batch_start, ids[-1])
+
+    @api.multi
+    def _move_batch(self, ids):
+        """Move attachments. If the batch fails, attachments are moved one by one.
+
+        :returns list: ids of attachments that are not moved
+        """
+        migration = self.migration_id
+        try:
+            with self.env.cr.savepoint():
+                migration._move_batch(ids)
+            return []
+        except Exception:
+            _logger.warning('Storage migration %s: batch with ids %s..%s failed, moving attachments one by one',
+                            migration.id, ids[0], ids[-1], exc_info=True)
+            self.env['ir.attachment'].invalidate_cache()
+        failed = []
+        for attachment_id in ids:
+            try:
+                with self.env.cr.savepoint():
+                    migration._move_batch([attachment_id])
+            except Exception:
+                _logger.exception('Storage migration %s: attachment %s is not moved', migration.id, attachment_id)
+                failed.append(attachment_id)
+        self.env['ir.attachment'].invalidate_cache()
+        return failed
+
+    @api.multi
+    def _deactivate_cron(self):
+        # Cron that is being executed is locked and updating it would wait
+        # for the end of its own execution. Such crons are skipped and
+        # stay active, but their calls do nothing for finished workers.
+        cron_ids = self.mapped('cron_id').ids
+        if not cron_ids:
+            return
+        self.env.cr.execute("""
+            UPDATE ir_cron SET active = false
+            WHERE id IN (
+                SELECT id FROM ir_cron WHERE id IN %s FOR UPDATE SKIP LOCKED
+            )
+        """, (tuple(cron_ids),))
+        self.env['ir.cron'].invalidate_cache(['active'])
@@ -0,0 +1,125 @@
+import base64
+
+from unittest.mock import patch
+
+from openerp.exceptions import UserError
+from openerp.tests.common import TransactionCase
+
+
+class TestMigration(TransactionCase):
+
+    def setUp(self):
+        super(TestMigration, self).setUp()
+        self.attachment = self.env['ir.attachment']
+        self.env['ir.config_parameter'].set_param('ir_attachment.location', 'db')
+        # attachments created before the test are not moved
+        self.env.cr.execute('SELECT coalesce(max(id), 0) FROM ir_attachment')
+        self.start_id = self.env.cr.fetchone()[0]
+        self.attachments = self.attachment
+        for i in range(5):
+            self.attachments |= self.attachment.create({
+                'name': 'migration %s' % i,
+                'datas': base64.b64encode(b'content %d' % i),
+            })
+
+    def _create_migration(self, **vals):
+        vals.setdefault('location', 'file')
+        return self.env['ir.attachment.storage.migration'].create(vals)
+
+    def _start(self, migration):
+        migration.action_start()
+        migration.worker_ids.write({'last_id': self.start_id})
+        return migration.worker_ids
+
+    def test_next_batch(self):
+        migration = self._create_migration(workers=2, batch_size=2)
+        found = []
+        for index in range(2):
+            last_id = self.start_id
+            while True:
+                ids = migration._next_batch(index, last_id)
+                if not ids:
+                    break
+                self.assertLessEqual(len(ids), 2)
+                self.assertEqual(ids, sorted(ids))
+                self.assertTrue(all(i % 2 == index and i > last_id for i in ids))
+                found += ids
+                # attachments are not moved, so only last_id moves the worker forward
+                last_id = ids[-1]
+        self.assertEqual(sorted(found), self.attachments.ids)
+
+    def test_run(self):
+        migration = self._create_migration(workers=1, batch_size=2)
+        bad = self.attachments[2]
+        copy_to_storage = type(self.attachment)._copy_to_storage
+
+        def _copy_to_storage(attachment, location):
+            if attachment.id == bad.id:
+                raise UserError('Test error')
+            return copy_to_storage(attachment, location)
+
+        worker = self._start(migration)
+        with patch.object(type(self.attachment), '_copy_to_storage', _copy_to_storage), \
+                patch.object(self.env.cr, 'commit'):
+            worker._run()
+
+        self.assertEqual(worker.state, 'done')
+        self.assertEqual(migration.state, 'done')
+        self.assertEqual(worker.last_id, self.attachments[-1].id)
+        self.assertEqual(worker.done_count, 4)
+        self.assertEqual(worker.failed_ids, str(bad.id))
+        self.assertFalse(bad.store_fname)
+        for i, attachment in enumerate(self.attachments):
+            if attachment != bad:
+                self.assertEqual(attachment._get_current_storage(), 'file')
+                self.assertEqual(attachment.datas, base64.b64encode(b'content %d' % i))
+
+    def test_pause_resume(self):
+        migration = self._create_migration(workers=2, batch_size=1)
+        workers = self._start(migration)
+        self.assertTrue(all(workers.mapped('cron_id.active')))
+
+        migration.action_pause()
+        self.assertEqual(migration.state, 'paused')
+        self.assertFalse(any(workers.mapped('cron_id.active')))
+        with patch.object(self.env.cr, 'commit'):
+            workers[0]._run()
+        self.assertEqual(workers[0].last_id, self.start_id)
+        self.assertFalse(any(self.attachments.mapped('store_fname')))
+
+        # resumed migration stops other running migrations
+        other = self._create_migration(location='db')
+        other.action_start()
+        migration.action_resume()
+        self.assertEqual(other.state, 'paused')
+        self.assertEqual(migration.state, 'running')
+        self.assertTrue(all(workers.mapped('cron_id.active')))
+
+        with patch.object(self.env.cr, 'commit'):
+            workers[0]._run()
+        self.assertEqual(workers[0].state, 'done')
+        self.assertEqual(workers[1].state, 'running')
+        self.assertEqual(migration.state, 'running')
+        # the worker that is not finished yet must keep its cron
+        self.assertFalse(workers[0].cron_id.active)
+        self.assertTrue(workers[1].cron_id.active)
+
+        with patch.object(self.env.cr, 'commit'):
+            workers[1]._run()
+        self.assertEqual(migration.state, 'done')
+        self.assertEqual(sum(workers.mapped('done_count')), 5)
+        self.assertTrue(all(self.attachments.mapped('store_fname')))
+
+    def test_plan(self):
+        migration = self._create_migration()
+
+        def _copy_to_storage(attachment, location):
+            raise UserError('Test error')
+
+        with patch.object(type(self.attachment), '_copy_to_storage', _copy_to_storage):
+            plan = migration._get_plan(sample_size=3)
+        line = next(line for line in plan if line['source'] == 'db')
+        self.assertGreaterEqual(line['count'], 5)
+        self.assertEqual(line['sample'], 3)
+        self.assertEqual(line['errors'], 3)
+        self.assertFalse(any(self.attachments.mapped('store_fname')))
@@ -0,0 +1,66 @@
+import base64
+
+from openerp.tests.common import TransactionCase
+
+from openerp.addons.attachment_large_object.ir_attachment import LARGE_OBJECT_LOCATION
+
+
+class TestStorage(TransactionCase):
+
+    def setUp(self):
+        super(TestStorage, self).setUp()
+        self.attachment = self.env['ir.attachment']
+        self.env['ir.config_parameter'].set_param('ir_attachment.location', 'db')
+
+    def _refcount(self, oid):
+        self.env.cr.execute("SELECT refcount FROM ir_attachment_lobject_ref WHERE oid = %s", (int(oid),))
+        row = self.env.cr.fetchone()
+        return row and row[0]
+
+    def test_round_trip(self):
+        bin_data = base64.b64encode(b'round trip content')
+        att = self.attachment.create({
+            'name': 'round trip',
+            'datas_fname': 'round_trip.txt',
+            'datas': bin_data,
+        })
+        checksum = att.checksum
+        mimetype = att.mimetype
+        index_content = att.index_content
+        self.assertTrue(index_content)
+
+        for location in ['file', LARGE_OBJECT_LOCATION, 'db']:
+            att._move_to_storage(location=location)
+            att.invalidate_cache()
+            self.assertEqual(att._get_current_storage(), location)
+            self.assertEqual(att.datas, bin_data)
+            self.assertEqual(att.checksum, checksum)
+            self.assertEqual(att.mimetype, mimetype)
+            self.assertEqual(att.index_content, index_content)
+        self.assertFalse(att.store_fname)
+
+    def test_shared_lobject(self):
+        bin_data = base64.b64encode(b'shared content')
+        att1 = self.attachment.create({'name': 'first', 'datas': bin_data})
+        att2 = self.attachment.create({'name': 'second', 'datas': bin_data})
+
+        (att1 | att2)._move_to_storage(location=LARGE_OBJECT_LOCATION)
+        oid = att1.store_fname
+        self.assertEqual(att2.store_fname, oid)
+        self.assertEqual(self._refcount(oid), 2)
+
+        att1._move_to_storage(location='file')
+        self.assertEqual(self._refcount(oid), 1)
+        self.assertEqual(att2.datas, bin_data)
+
+        att2._move_to_storage(location='db')
+        self.assertFalse(self._refcount(oid))
+        self.assertEqual(att1.datas, bin_data)
+        self.assertEqual(att2.datas, bin_data)
+
+    def test_unknown_storage(self):
+        bin_data = base64.b64encode(b'unknown storage')
+        att = self.attachment.create({'name': 'unknown', 'datas': bin_data})
+        # storages of other modules are written by ORM
+        att._move_to_storage(location='unknown')
+        self.assertEqual(att.datas, bin_data)
@@ -3,7 +3,7 @@
     "summary": """Upload attachments on Amazon S3""",
     "category": "Tools",
     "images": [],
-    "version": "11.0.1.2.0",
+    "version": "11.0.1.4.0",
     "application": False,
 
     "author": "IT-Projects LLC, Ildar Nasyrov",
@@ -1,2 +1,3 @@
 from . import ir_attachment
 from . import res_config_settings
+from . import ir_config_parameter
@@ -1,13 +1,13 @@
 # Copyright 2016-2018 Ildar Nasyrov <https://it-projects.info/team/iledarn>
 # Copyright 2016-2018 Ivan Yelizariev <https://it-projects.info/team/yelizariev>
-import base64
 import os
-import hashlib
 import logging
 
 from odoo import api, models, _, fields
 from odoo.tools.safe_eval import safe_eval
 
+from .. import multipart
+
 _logger = logging.getLogger(__name__)
 
 try:
@@ -16,6 +16,18 @@ except:
     _logger.debug('boto3 package is required which is not \
     found on your installation')
 
+# boto3 clients are thread-safe, but can't be shared with forked processes:
+# {(pid, access key id, secret key): client}
+_s3_clients = {}
+# urls of buckets don't change, so get_bucket_location is called once per
+# bucket: {bucket name: url prefix}
+_s3_url_prefixes = {}
+
+
+def clear_s3_cache():
+    _s3_clients.clear()
+    _s3_url_prefixes.clear()
+
 
 class IrAttachmentResized(models.Model):
     _name = 'ir.attachment.resized'
@@ -43,18 +55,20 @@ class IrAttachment(models.Model):
         return res
 
     @api.model
-    def _get_s3_object_url(self, s3, s3_bucket_name, key_name):
-        bucket_location = s3.meta.client.get_bucket_location(Bucket=s3_bucket_name)
-        location_constraint = bucket_location.get('LocationConstraint')
-        domain_part = 's3' + '-' + location_constraint if location_constraint else 's3'
-        object_url = "https://{0}.amazonaws.com/{1}/{2}".format(
-            domain_part,
-            s3_bucket_name,
-            key_name)
-        return object_url
+    def _get_s3_object_url(self, client, s3_bucket_name, key_name):
+        prefix = _s3_url_prefixes.get(s3_bucket_name)
+        if prefix is None:
+            bucket_location = client.get_bucket_location(Bucket=s3_bucket_name)
+            location_constraint = bucket_location.get('LocationConstraint')
+            domain_part = 's3' + '-' + location_constraint if location_constraint else 's3'
+            prefix = "https://{0}.amazonaws.com/{1}/".format(
+                domain_part,
+                s3_bucket_name)
+            _s3_url_prefixes[s3_bucket_name] = prefix
+        return prefix + key_name
 
     @api.model
-    def _get_s3_resource(self):
+    def _get_s3_client(self):
         access_key_id = self._get_s3_settings('s3.access_key_id', 'S3_ACCESS_KEY_ID')
         secret_key = self._get_s3_settings('s3.secret_key', 'S3_SECRET_KEY')
         bucket_name = self._get_s3_settings('s3.bucket', 'S3_BUCKET')
@@ -63,15 +77,62 @@ class IrAttachment(models.Model):
             _logger.info(_('Amazon S3 credentials are not defined properly. Attachments won\'t be saved on S3.'))
             return False
 
-        s3 = boto3.resource(
+        key = (os.getpid(), access_key_id, secret_key)
+        client = _s3_clients.get(key)
+        if client:
+            return client
+        client = boto3.client(
             's3',
             aws_access_key_id=access_key_id,
             aws_secret_access_key=secret_key,
             )
-        bucket = s3.Bucket(bucket_name)
-        if not bucket:
-            s3.create_bucket(Bucket=bucket_name)
-        return s3
+        _s3_clients[key] = client
+        return client
+
+    @api.model
+    def _get_s3_upload_settings(self):
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return {
+            'part_size': int(get_param('s3.multipart_chunksize', multipart.DEFAULT_PART_SIZE)),
+            'threshold': int(get_param('s3.multipart_threshold', multipart.DEFAULT_THRESHOLD)),
+            'max_workers': int(get_param('s3.multipart_workers', multipart.DEFAULT_WORKERS)),
+        }
+
+    @api.multi
+    def _upload_to_s3(self, client, bucket_name):
+        """Upload content of the attachment to S3 without decoding it at once.
+
+        :returns dict: values to write to the attachment
+        """
+        self.ensure_one()
+        value = self.datas or b''
+        settings = self._get_s3_upload_settings()
+        fname, size = multipart.digest(multipart.b64decode_chunks(value))
+        if size < settings['threshold']:
+            # small content is uploaded at once and is indexed as usual
+            index_data = b''.join(multipart.b64decode_chunks(value))
+            chunks = [index_data]
+        else:
+            chunks = multipart.b64decode_chunks(value)
+            # big content is decoded at once only if it can be indexed
+            index_data = b''
+            if (self.mimetype or '').startswith('text'):
+                index_data = b''.join(multipart.b64decode_chunks(value))
+        multipart.upload(
+            client, bucket_name, fname, chunks, size,
+            ACL='public-read',
+            ContentType=self.mimetype,
+            **settings
+        )
+        return {
+            'file_size': size,
+            'checksum': fname,
+            'index_content': self._index(index_data, self.datas_fname, self.mimetype),
+            'store_fname': fname,
+            'db_datas': False,
+            'type': 'url',
+            'url': self._get_s3_object_url(client, bucket_name, fname),
+        }
 
     def _inverse_datas(self):
         condition = self._get_s3_settings('s3.condition', 'S3_CONDITION')
@@ -84,8 +145,8 @@ class IrAttachment(models.Model):
             s3_records = self
 
         if s3_records:
-            s3 = self._get_s3_resource()
-            if not s3:
+            client = self._get_s3_client()
+            if not client:
                 _logger.info('something wrong on aws side, keep attachments as usual')
                 s3_records = self.env[self._name]
             else:
@@ -95,27 +156,8 @@ class IrAttachment(models.Model):
         resized_to_remove = self.env['ir.attachment.resized'].sudo()
         for attach in self & s3_records:  # datas field has got empty somehow in the result of ``s3_records = self.sudo().search([('id', 'in', self.ids)] + condition)`` search for non-superusers but it is in original recordset. Here we use original (with datas) in case it intersects with the search result
             resized_to_remove |= attach.sudo().resized_ids
-            value = attach.datas
-            bin_data = base64.b64decode(value) if value else b''
-            fname = hashlib.sha1(bin_data).hexdigest()
-
             bucket_name = self._get_s3_settings('s3.bucket', 'S3_BUCKET')
-            s3.Bucket(bucket_name).put_object(
-                Key=fname,
-                Body=bin_data,
-                ACL='public-read',
-                ContentType=attach.mimetype,
-                )
-
-            vals = {
-                'file_size': len(bin_data),
-                'checksum': self._compute_checksum(bin_data),
-                'index_content': self._index(bin_data, attach.datas_fname, attach.mimetype),
-                'store_fname': fname,
-                'db_datas': False,
-                'type': 'url',
-                'url': self._get_s3_object_url(s3, bucket_name, fname),
-            }
+            vals = attach._upload_to_s3(client, bucket_name)
             super(IrAttachment, attach.sudo()).write(vals)
 
         resized_to_remove.mapped('resized_attachment_id').unlink()
@@ -0,0 +1,28 @@
+from odoo import api, models
+
+from .ir_attachment import clear_s3_cache
+
+
+class IrConfigParameter(models.Model):
+    _inherit = 'ir.config_parameter'
+
+    @api.model
+    def create(self, vals):
+        if (vals.get('key') or '').startswith('s3.'):
+            clear_s3_cache()
+        return super(IrConfigParameter, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self._clear_s3_cache()
+        return super(IrConfigParameter, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self._clear_s3_cache()
+        return super(IrConfigParameter, self).unlink()
+
+    @api.multi
+    def _clear_s3_cache(self):
+        if any(r.key.startswith('s3.') for r in self):
+            clear_s3_cache()
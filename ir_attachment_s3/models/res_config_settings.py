@@ -1,6 +1,3 @@
-import base64
-import hashlib
-
 from odoo.tools.safe_eval import safe_eval
 from odoo import models, fields, api, exceptions, _
 
@@ -50,35 +47,14 @@ class ResConfigSettings(models.TransientModel):
 
         if attachments:
 
-            s3 = self.env['ir.attachment']._get_s3_resource()
+            client = self.env['ir.attachment']._get_s3_client()
 
-            if not s3:
+            if not client:
                 raise exceptions.MissingError(_("Some of the S3 connection credentials are missing.\n Don't forget to click the ``[Apply]`` button after any changes you've made"))
 
             for attach in attachments:
-                value = attach.datas
-                bin_data = base64.b64decode(value) if value else b''
-                fname = hashlib.sha1(bin_data).hexdigest()
-
-                bucket_name = self.s3_bucket
-
                 try:
-                    s3.Bucket(bucket_name).put_object(
-                        Key=fname,
-                        Body=bin_data,
-                        ACL='public-read',
-                        ContentType=attach.mimetype,
-                        )
+                    vals = attach._upload_to_s3(client, self.s3_bucket)
                 except Exception as e:
                     raise exceptions.UserError(e.message)
-
-                vals = {
-                    'file_size': len(bin_data),
-                    'checksum': attach._compute_checksum(bin_data),
-                    'index_content': attach._index(bin_data, attach.datas_fname, attach.mimetype),
-                    'store_fname': fname,
-                    'db_datas': False,
-                    'type': 'url',
-                    'url': attach._get_s3_object_url(s3, bucket_name, fname),
-                }
                 attach.write(vals)
@@ -0,0 +1,98 @@
+import base64
+import binascii
+import hashlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+# minimal part size allowed by S3, except the last part
+MIN_PART_SIZE = 5 * MB
+DEFAULT_PART_SIZE = 8 * MB
+DEFAULT_THRESHOLD = 8 * MB
+DEFAULT_WORKERS = 4
+# size of base64 chunks decoded at once
+B64_CHUNK_SIZE = 4 * MB
+
+
+def b64decode_chunks(value, chunk_size=B64_CHUNK_SIZE):
+    """Decode base64 encoded value chunk by chunk. Line breaks are ignored.
+
+    Same as ``b64decode_iter`` of ``attachment_large_object``, copied to not
+    make the module depend on it. Keep both in sync.
+    """
+    if isinstance(value, str):
+        value = value.encode('ascii')
+    rest = b''
+    for start in range(0, len(value), chunk_size):
+        chunk = rest + b''.join(value[start:start + chunk_size].split())
+        size = len(chunk) - len(chunk) % 4
+        rest = chunk[size:]
+        if size:
+            yield binascii.a2b_base64(chunk[:size])
+    if rest:
+        yield base64.b64decode(rest)
+
+
+def digest(chunks):
+    """Return sha1 and size of the content."""
+    sha = hashlib.sha1()
+    size = 0
+    for chunk in chunks:
+        sha.update(chunk)
+        size += len(chunk)
+    return sha.hexdigest(), size
+
+
+def iter_parts(chunks, part_size):
+    """Regroup chunks to parts of ``part_size`` bytes. The last one may be smaller."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= part_size:
+            yield bytes(buf[:part_size])
+            del buf[:part_size]
+    if buf:
+        yield bytes(buf)
+
+
+def upload(client, bucket, key, chunks, size,
+           part_size=DEFAULT_PART_SIZE, threshold=DEFAULT_THRESHOLD, max_workers=DEFAULT_WORKERS, **kwargs):
+    """Upload the content to S3.
+
+    Content smaller than ``threshold`` is uploaded by one request. Bigger
+    content is uploaded by parts in ``max_workers`` threads. Not more than
+    ``max_workers`` parts are kept in memory at once.
+
+    :param client: low-level boto3 client, it's thread-safe unlike resources
+    :param chunks: iterable of bytes
+    :param size: total size of the content
+    :param kwargs: extra arguments of the upload, e.g. ACL and ContentType
+    """
+    if size < threshold:
+        client.put_object(Bucket=bucket, Key=key, Body=b''.join(chunks), **kwargs)
+        return
+
+    part_size = max(part_size, MIN_PART_SIZE)
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, **kwargs)['UploadId']
+    try:
+        parts = []
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for number, part in enumerate(iter_parts(chunks, part_size), 1):
+                if len(pending) >= max_workers:
+                    parts.append(_wait_part(pending))
+                pending.append((number, executor.submit(
+                    client.upload_part, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=part)))
+            while pending:
+                parts.append(_wait_part(pending))
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+def _wait_part(pending):
+    number, future = pending.popleft()
+    return {'ETag': future.result()['ETag'], 'PartNumber': number}
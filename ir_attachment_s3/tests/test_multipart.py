@@ -0,0 +1,82 @@
+import base64
+import threading
+
+from odoo.tests.common import BaseCase
+
+from .. import multipart
+
+
+class FakeS3Client(object):
+    """In-memory stand-in for boto3 S3 client."""
+
+    def __init__(self, fail_part=None):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.fail_part = fail_part
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls.append(name)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call('put_object')
+        self.objects[(Bucket, Key)] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call('create_multipart_upload')
+        upload_id = 'upload-%s' % len(self.uploads)
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._call('upload_part')
+        if PartNumber == self.fail_part:
+            raise IOError('Connection reset')
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': 'etag-%s' % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._call('complete_multipart_upload')
+        parts = self.uploads.pop(UploadId)
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        assert numbers == sorted(parts), 'Parts are not in order'
+        self.objects[(Bucket, Key)] = b''.join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._call('abort_multipart_upload')
+        self.uploads.pop(UploadId)
+
+
+class TestMultipart(BaseCase):
+
+    def _upload(self, client, data, **kwargs):
+        value = base64.b64encode(data)
+        fname, size = multipart.digest(multipart.b64decode_chunks(value, chunk_size=1000))
+        multipart.upload(client, 'bucket', fname, multipart.b64decode_chunks(value, chunk_size=1000), size, **kwargs)
+        return fname
+
+    def test_small(self):
+        client = FakeS3Client()
+        data = b'small content'
+        fname = self._upload(client, data, threshold=1024)
+        self.assertEqual(client.calls, ['put_object'])
+        self.assertEqual(client.objects[('bucket', fname)], data)
+
+    def test_multipart(self):
+        client = FakeS3Client()
+        data = bytes(bytearray(range(256))) * (40 * 1024)  # 10 MB
+        fname = self._upload(client, data, threshold=1024, part_size=multipart.MIN_PART_SIZE, max_workers=2)
+        self.assertEqual(client.calls.count('upload_part'), 2)
+        self.assertEqual(client.objects[('bucket', fname)], data)
+
+    def test_abort(self):
+        client = FakeS3Client(fail_part=2)
+        data = b'x' * (11 * multipart.MB)
+        with self.assertRaises(IOError):
+            self._upload(client, data, threshold=1024, part_size=multipart.MIN_PART_SIZE)
+        self.assertIn('abort_multipart_upload', client.calls)
+        self.assertFalse(client.uploads)
+        self.assertFalse(client.objects)
@@ -46,7 +46,7 @@ class OpenERPSession(openerp.http.OpenERPSession):
             pass
 
         if env and hasattr(env, 'registry') and env.registry.get('ir.sessions'):
-            session = env['ir.sessions'].sudo().search([('session_id', '=', self.sid)])
+            session = env['ir.sessions'].sudo().get_active_session(self.sid)
             if session:
                 session._on_session_logout(logout_type)
         return super(OpenERPSession, self).logout(keep_db=keep_db)
@@ -22,8 +22,13 @@
 #
 #
 
+import atexit
 import logging
-from openerp import api, models, fields
+import os
+import threading
+import time
+import openerp
+from openerp import api, models, fields, SUPERUSER_ID
 from datetime import datetime
 from datetime import timedelta
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
@@ -35,18 +40,87 @@ LOGOUT_TYPES = [('ur', 'User Request'),
                 ('to', 'Timeout'),
                 ('re', 'Rule enforcing')]
 
+# Activity of sessions is kept in memory of the worker and saved periodically.
+# {dbname: {sid: date_last_activity}}
+_activity_buffer = {}
+# {dbname: time of last flush}
+_activity_flushed_at = {}
+# {dbname: flush interval}
+_activity_intervals = {}
+_activity_lock = threading.Lock()
+# pid of the process where the flushing thread is started
+_activity_flusher_pid = None
+
+ACTIVITY_FLUSH_INTERVAL = 60  # seconds
+# how often the flushing thread checks buffers
+ACTIVITY_TIMER = 10  # seconds
+
+
+def flush_activity(dbnames=None):
+    """Save buffered activity of the databases in separate cursors."""
+    for dbname in list(dbnames or _activity_buffer):
+        try:
+            # called out of requests: by the flushing thread and on exit
+            with api.Environment.manage(), openerp.registry(dbname).cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env['ir.sessions']._flush_last_activity()
+        except Exception:
+            _logger.exception('Failed to save activity of sessions in database %s', dbname)
+
+
+def _flush_due_activity():
+    while True:
+        time.sleep(ACTIVITY_TIMER)
+        now = time.time()
+        with _activity_lock:
+            dbnames = [
+                dbname for dbname in _activity_buffer
+                if now - _activity_flushed_at.get(dbname, now) >=
+                _activity_intervals.get(dbname, ACTIVITY_FLUSH_INTERVAL)
+            ]
+        if dbnames:
+            flush_activity(dbnames)
+
+
+def _start_activity_flusher():
+    """Save activity periodically and on exit of the worker, even if it's idle."""
+    global _activity_flusher_pid
+    with _activity_lock:
+        if _activity_flusher_pid == os.getpid():
+            return
+        _activity_flusher_pid = os.getpid()
+    thread = threading.Thread(target=_flush_due_activity, name='SessionsActivityFlusher')
+    thread.daemon = True
+    thread.start()
+    atexit.register(flush_activity)
+
+
+# number of sessions replaced in session store at once
+STORE_BATCH_SIZE = 500
+
+# closed sessions older than that are moved to ir.sessions.history
+ARCHIVE_DAYS = 30
+ARCHIVE_BATCH_SIZE = 10000
+
+# columns copied from ir_sessions to ir_sessions_history
+ARCHIVE_COLUMNS = ['user_id', 'session_id', 'date_login', 'date_last_activity',
+                   'expiration_seconds', 'expiration_date', 'date_logout',
+                   'logout_type', 'session_lenght',
+                   'create_uid', 'create_date', 'write_uid', 'write_date']
+
 
 class IrSessions(models.Model):
     _name = 'ir.sessions'
     _description = "Sessions"
 
     user_id = fields.Many2one('res.users', 'User', ondelete='cascade', required=True)
-    logged_in = fields.Boolean('Logged in', required=True, index=True)
-    session_id = fields.Char('Session ID', size=100, required=True, index=True)
+    # hot queries filter by logged_in and use partial indexes, see init()
+    logged_in = fields.Boolean('Logged in', required=True)
+    session_id = fields.Char('Session ID', size=100, required=True)
     date_login = fields.Datetime('Login', required=True)
     date_last_activity = fields.Datetime('Last Activity Date')
-    expiration_seconds = fields.Integer('Seconds to Expire', index=True)
-    expiration_date = fields.Datetime('Expiration date', compute='_compute_expiration_date', store=True, index=True)
+    expiration_seconds = fields.Integer('Seconds to Expire')
+    expiration_date = fields.Datetime('Expiration date', compute='_compute_expiration_date', store=True)
     date_logout = fields.Datetime('Logout')
     logout_type = fields.Selection(LOGOUT_TYPES, 'Logout Type')
     session_lenght = fields.Datetime('Session Duration')
@@ -54,20 +128,136 @@ class IrSessions(models.Model):
 
     _order = 'date_logout desc'
 
+    @api.model_cr
+    def init(self):
+        # Active sessions are a small part of the table, so indexes are built
+        # on them only. Closed sessions are indexed for archiving.
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS ir_sessions_active_session_id_index
+            ON ir_sessions (session_id) WHERE logged_in
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS ir_sessions_active_expiration_date_index
+            ON ir_sessions (expiration_date) WHERE logged_in
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS ir_sessions_closed_date_logout_index
+            ON ir_sessions (date_logout) WHERE NOT logged_in
+        """)
+
+    @api.model
+    def search_active(self, domain=None, **kwargs):
+        """Search among logged in sessions only, so partial indexes are used."""
+        return self.search([('logged_in', '=', True)] + (domain or []), **kwargs)
+
+    @api.model
+    def get_active_session(self, sid):
+        """Return logged in session with given sid or empty recordset."""
+        return self.search_active([('session_id', '=', sid)], limit=1)
+
     # scheduler function to validate users session
     @api.model
     def validate_sessions(self):
-        res = self.search([('logged_in', '=', True),
-                           ('expiration_date', '!=', False),
-                           ('expiration_date', '<=', fields.Datetime.now()),
-                           ])
-        res._close_session(logout_type='to')
+        # Activity is saved not later than flush interval plus timer period
+        # after the request, unless the worker is killed. Twice the interval
+        # covers it with the default timer period.
+        deadline = datetime.utcnow() - timedelta(seconds=2 * self._get_activity_flush_interval())
+        self.env.cr.execute("""
+            UPDATE ir_sessions
+            SET logged_in = false,
+                date_logout = %s,
+                logout_type = 'to'
+            WHERE logged_in AND expiration_date <= %s
+            RETURNING session_id
+        """, (fields.Datetime.now(), fields.Datetime.to_string(deadline)))
+        sids = [row[0] for row in self.env.cr.fetchall()]
+        self.invalidate_cache(['logged_in', 'date_logout', 'logout_type'])
+        _logger.debug('%s sessions are expired', len(sids))
+        self._invalidate_store_sessions(sids)
         return True
 
+    @api.model
+    def archive_sessions(self, days=None, batch_size=None):
+        """Move closed sessions older than ``days`` to ir.sessions.history.
+
+        Sessions are moved in batches and every batch is committed, so the
+        job may be interrupted without losing the progress.
+
+        :returns int: number of archived sessions
+        """
+        if days is None:
+            days = int(self.env['ir.config_parameter'].sudo().get_param(
+                'web_sessions_management.archive_days', ARCHIVE_DAYS))
+        batch_size = batch_size or ARCHIVE_BATCH_SIZE
+        deadline = fields.Datetime.to_string(datetime.utcnow() - timedelta(days=days))
+        columns = ', '.join(ARCHIVE_COLUMNS)
+        query = """
+            WITH moved AS (
+                DELETE FROM ir_sessions
+                WHERE id IN (
+                    SELECT id FROM ir_sessions
+                    WHERE NOT logged_in AND date_logout < %s
+                    LIMIT %s
+                )
+                RETURNING {columns}
+            )
+            INSERT INTO ir_sessions_history ({columns})
+            SELECT {columns} FROM moved
+        """.format(columns=columns)
+        total = 0
+        while True:
+            self.env.cr.execute(query, (deadline, batch_size))
+            moved = self.env.cr.rowcount
+            self.env.cr.commit()
+            total += moved
+            _logger.debug('%s sessions are archived', total)
+            if moved < batch_size:
+                break
+        self.invalidate_cache()
+        _logger.info('%s sessions are archived', total)
+        return total
+
+    @api.model
+    def _get_activity_flush_interval(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            'web_sessions_management.activity_flush_interval', ACTIVITY_FLUSH_INTERVAL))
+
     @api.model
     def update_last_activity(self, sid):
-        res = self.sudo().search([('logged_in', '=', True), ('session_id', '=', sid)])
-        res.write({'date_last_activity': fields.Datetime.now()})
+        """Remember activity of the session. It's saved to database periodically.
+
+        :returns bool: True if buffered activity has to be saved by ``_flush_last_activity``
+        """
+        dbname = self.env.cr.dbname
+        now = fields.Datetime.now()
+        interval = self._get_activity_flush_interval()
+        _start_activity_flusher()
+        with _activity_lock:
+            _activity_buffer.setdefault(dbname, {})[sid] = now
+            _activity_intervals[dbname] = interval
+            flushed_at = _activity_flushed_at.setdefault(dbname, time.time())
+        return time.time() - flushed_at >= interval
+
+    @api.model
+    def _flush_last_activity(self):
+        """Save buffered activity of sessions by one query."""
+        dbname = self.env.cr.dbname
+        with _activity_lock:
+            activity = _activity_buffer.pop(dbname, {})
+            _activity_flushed_at[dbname] = time.time()
+        if not activity:
+            return
+        self.env.cr.execute("""
+            UPDATE ir_sessions s
+            SET date_last_activity = v.date_last_activity,
+                expiration_date = CASE WHEN s.expiration_seconds > 0
+                    THEN v.date_last_activity + s.expiration_seconds * interval '1 second'
+                    END
+            FROM (VALUES %s) AS v (session_id, date_last_activity)
+            WHERE s.session_id = v.session_id AND s.logged_in
+        """ % ', '.join(['(%s, %s::timestamp)'] * len(activity)),
+            [value for item in activity.items() for value in item])
+        self.invalidate_cache(['date_last_activity', 'expiration_date'])
 
     @api.one
     @api.depends('date_last_activity', 'expiration_seconds')
@@ -94,27 +284,51 @@ class IrSessions(models.Model):
 
     @api.multi
     def _close_session(self, logout_type=None):
-        redirect = False
-        for r in self:
-            if r.user_id.id == self.env.user.id:
-                redirect = True
-            session = root.session_store.get(r.session_id)
-            session.logout(keep_db=True, logout_type=logout_type, env=self.env)
-            # we have to call delete function so user would not able
-            # to continue use session
-            root.session_store.delete(session)
-            # we have to create new session with the same sid, so the
-            # system will know which database user is trying to
-            # use. In that case system shows Session Expired warning
-            # instead of Not Found error.
-            new_session = root.session_store.get(session.sid)
-            new_session.db = session.db
-            root.session_store.save(session)
+        redirect = any(r.user_id.id == self.env.user.id for r in self)
+        self._on_session_logout(logout_type)
+        self._invalidate_store_sessions(self.mapped('session_id'))
         return redirect
 
+    @api.model
+    def _invalidate_store_sessions(self, sids):
+        """Replace sessions in session store with empty ones.
+
+        User is not able to continue to use the session, but new session
+        keeps the database, so the system shows Session Expired warning
+        instead of Not Found error.
+        """
+        store = root.session_store
+        for start in range(0, len(sids), STORE_BATCH_SIZE):
+            sessions = [
+                store.session_class({'db': self.env.cr.dbname}, sid, False)
+                for sid in sids[start:start + STORE_BATCH_SIZE]
+            ]
+            if hasattr(store, 'save_many'):
+                store.save_many(sessions)
+                continue
+            for session in sessions:
+                store.save(session)
+
     @api.multi
     def _on_session_logout(self, logout_type=None):
         self.write({'logged_in': False,
-                date_logout = fields.Datetime.now()
+                    'date_logout': fields.Datetime.now(),
                     'logout_type': logout_type,
                     })
+
+
+class IrSessionsHistory(models.Model):
+    _name = 'ir.sessions.history'
+    _description = "Sessions History"
+
+    user_id = fields.Many2one('res.users', 'User', ondelete='cascade', required=True, index=True)
+    session_id = fields.Char('Session ID', size=100, required=True)
+    date_login = fields.Datetime('Login', required=True)
+    date_last_activity = fields.Datetime('Last Activity Date')
+    expiration_seconds = fields.Integer('Seconds to Expire')
+    expiration_date = fields.Datetime('Expiration date')
+    date_logout = fields.Datetime('Logout', index=True)
+    logout_type = fields.Selection(LOGOUT_TYPES, 'Logout Type')
+    session_lenght = fields.Datetime('Session Duration')
+
+    _order = 'date_logout desc'
@@ -73,14 +73,11 @@ class HomeTkobr(openerp.addons.web.controllers.main.Home):
             request.uid = openerp.SUPERUSER_ID
         sid = request.httprequest.session.sid
         uid = request.httprequest.session.uid
-        session_obj = request.registry.get('ir.sessions')
-        user_obj = request.registry.get('res.users')
-        u_exp_date, seconds = user_obj.get_expiring_date(cr, request.uid,
-                                                         uid, context)
-        return session_obj.create(cr, SUPERUSER_ID, {'user_id': uid,
-                                                     'session_id': sid,
-                                                     'expiration_seconds': seconds,
-                                                 date_login = fields.Datetime.now()
-                                                 date_last_activity = fields.Datetime.now()
-                                                     'logged_in': True},
-                                  context=context)
+        env = request.env(user=SUPERUSER_ID)
+        u_exp_date, seconds = env['res.users'].get_expiring_date(uid)
+        return env['ir.sessions'].create({'user_id': uid,
+                                          'session_id': sid,
+                                          'expiration_seconds': seconds,
+                                          'date_login': fields.Datetime.now(),
+                                          'date_last_activity': fields.Datetime.now(),
+                                          'logged_in': True})
@@ -22,21 +22,46 @@
 #
 #
 
+from openerp import api
 from openerp import fields
 from openerp import models
 
+from .res_users import SESSION_POLICY_FIELDS
+
 
 class ResGroups(models.Model):
     _inherit = 'res.groups'
 
 
-    login_calendar_id = fields.Many2one('resource.calendar'
-                                             'Allow Login Calendar', company_dependent=True,
-                                             help='The user will be only allowed to login in the calendar defined here.'),
+    login_calendar_id = fields.Many2one('resource.calendar',
+                                        'Allow Login Calendar', company_dependent=True,
+                                        help='The user will be only allowed to login in the calendar defined here.')
     no_multiple_sessions = fields.Boolean('No Multiple Sessions', company_dependent=True,
-                                               help='Select this to prevent user to start a session more than once'),
+                                          help='Select this to prevent user to start a session more than once')
     interval_number = fields.Integer('Session Timeout', company_dependent=True, help='Timeout since last activity for auto logout')
-    interval_type = fields.Selection([('minutes', 'Minutes')
-                                           ('hours', 'Hours'), ('work_days', 'Work Days'),
-                                           ('days', 'Days'), ('weeks', 'Weeks'), ('months', 'Months')],
-                                          'Interval Unit', company_dependent=True),
+    interval_type = fields.Selection([('minutes', 'Minutes'),
+                                      ('hours', 'Hours'), ('work_days', 'Work Days'),
+                                      ('days', 'Days'), ('weeks', 'Weeks'), ('months', 'Months')],
+                                     'Interval Unit', company_dependent=True)
+
+    @api.model
+    def create(self, vals):
+        res = super(ResGroups, self).create(vals)
+        self._clear_session_policy_cache(vals)
+        return res
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResGroups, self).write(vals)
+        self._clear_session_policy_cache(vals)
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(ResGroups, self).unlink()
+        self.env['res.users']._get_session_policy.clear_cache(self.env['res.users'])
+        return res
+
+    def _clear_session_policy_cache(self, vals):
+        if set(vals) & set(SESSION_POLICY_FIELDS + ['users', 'implied_ids']):
+            self.env['res.users']._get_session_policy.clear_cache(self.env['res.users'])
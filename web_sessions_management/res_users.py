@@ -22,58 +22,82 @@
 #
 #
 
+from openerp import api
 from openerp import fields
 from openerp import models
+from openerp import tools
 from datetime import datetime
 from openerp import SUPERUSER_ID
-from openerp.http import request
 from openerp.addons.base.models.ir_cron import _intervalTypes
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
 
+# fields of res.users and res.groups that define session policy
+SESSION_POLICY_FIELDS = ['no_multiple_sessions', 'interval_number', 'interval_type']
+
+# sessions expire not later than in a week
+DEFAULT_INTERVAL = ('weeks', 1)
+
 
 class ResUsers(models.Model):
     _inherit = 'res.users'
 
 
-    login_calendar_id = fields.Many2one('resource.calendar'
-                                             'Allowed Login Calendar', company_dependent=True,
-                                             help='The user will be only allowed to login in the calendar defined here.'),
+    login_calendar_id = fields.Many2one('resource.calendar',
+                                        'Allowed Login Calendar', company_dependent=True,
+                                        help='The user will be only allowed to login in the calendar defined here.')
     no_multiple_sessions = fields.Boolean('No Multiple Sessions', company_dependent=True,
-                                               help='Select this to prevent user to start a session more than once'),
+                                          help='Select this to prevent user to start a session more than once')
     interval_number = fields.Integer('Session Timeout', company_dependent=True, help='Timeout since last activity for auto logout')
-    interval_type = fields.Selection([('minutes', 'Minutes')
-                                           ('hours', 'Hours'), ('work_days', 'Work Days'),
-                                           ('days', 'Days'), ('weeks', 'Weeks'), ('months', 'Months')],
-                                          'Interval Unit', company_dependent=True),
+    interval_type = fields.Selection([('minutes', 'Minutes'),
+                                      ('hours', 'Hours'), ('work_days', 'Work Days'),
+                                      ('days', 'Days'), ('weeks', 'Weeks'), ('months', 'Months')],
+                                     'Interval Unit', company_dependent=True)
     session_ids = fields.One2many('ir.sessions', 'user_id', 'User Sessions')
 
+    @api.multi
+    def write(self, vals):
+        res = super(ResUsers, self).write(vals)
+        if set(vals) & set(SESSION_POLICY_FIELDS + ['groups_id']):
+            self._get_session_policy.clear_cache(self)
+        return res
+
+    @tools.ormcache('user_id')
+    def _get_session_policy(self, user_id):
+        """Combine session rules of the user and the user's groups.
+
+        :returns tuple: (intervals, no_multiple_sessions). Session expires
+                        after the shortest of intervals. Each interval is
+                        a tuple (interval_type, interval_number)
+        """
+        if user_id == SUPERUSER_ID:
+            return (DEFAULT_INTERVAL,), False
+        user = self.browse(user_id).sudo()
+        intervals = {DEFAULT_INTERVAL}
+        no_multiple_sessions = user.no_multiple_sessions
+        for record in user | user.groups_id:
+            if record.interval_type:
+                intervals.add((record.interval_type, record.interval_number))
+        for group in user.groups_id:
+            no_multiple_sessions = no_multiple_sessions or group.no_multiple_sessions
+        return tuple(sorted(intervals)), bool(no_multiple_sessions)
 
     # get earlier expiring date
-    def get_expiring_date(self, cr, uid, id, context):
+    @api.model
+    def get_expiring_date(self, user_id):
+        return self.get_expiring_dates([user_id])[user_id]
+
+    @api.model
+    def get_expiring_dates(self, user_ids):
+        """Compute expiring dates for several users at once, e.g. in cron.
+
+        :returns dict: user_id -> (expiring date, seconds to expire)
+        """
         now = datetime.now()
-        user_obj = request.registry.get('res.users')
-        user_id = user_obj.browse(cr, SUPERUSER_ID, id, context=context)
-        g_exp_date = now + _intervalTypes['weeks'](1)
-        if id != SUPERUSER_ID:
-            if user_id.interval_type:
-                u_exp_date = now + _intervalTypes[user_id.interval_type](user_id.interval_number)
-            else:
-                u_exp_date = g_exp_date
-            g_no_multiple_sessions = False
-            # u_no_multiple_sessions = user_id.no_multiple_sessions
-            for group in user_id.groups_id:
-                if group.no_multiple_sessions:
-                    g_no_multiple_sessions = True
-                if group.interval_type:
-                    t_exp_date = now + _intervalTypes[group.interval_type](group.interval_number)
-                    if t_exp_date < g_exp_date:
-                        g_exp_date = t_exp_date
-            if g_no_multiple_sessions:
-                # u_no_multiple_sessions = True
-                pass
-            if g_exp_date < u_exp_date:
-                u_exp_date = g_exp_date
-        else:
-            u_exp_date = g_exp_date
-        seconds = u_exp_date - now
-        return datetime.strftime(u_exp_date, DEFAULT_SERVER_DATETIME_FORMAT), seconds.seconds
+        res = {}
+        for user_id in user_ids:
+            intervals, no_multiple_sessions = self._get_session_policy(user_id)
+            exp_date = min(now + _intervalTypes[interval_type](interval_number)
+                           for interval_type, interval_number in intervals)
+            seconds = exp_date - now
+            res[user_id] = (datetime.strftime(exp_date, DEFAULT_SERVER_DATETIME_FORMAT), int(seconds.total_seconds()))
+        return res